@@ -8,14 +8,24 @@ from typing import List, Optional
 import typer
 from rich import print
 
+from atp.jobs.queue import DEFAULT_JOBS_DB
+from atp.jobs.worker import run_worker
+from atp.rag.compact import build_compact_index
 from atp.rag.rag_core import (
-    add_textfile_to_vectorstore,
-    answer_query,
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_TOP_K,
+    QueryResult,
     build_vectorstore_from_pdfs,
     extract_pdfs_text,
-    retrieve_hits,
+    run_query,
 )
-from atp.web.index import index_web_text
+from atp.rag.snapshot import export_snapshot, import_snapshot
+from atp.rag.sweep import DEFAULT_EMBED_CACHE, run_sweep
+from atp.store.artifacts import ArtifactStore, new_run_id
+from atp.web.crawl import DEFAULT_FRONTIER_DB, DEFAULT_USER_AGENT, CrawlConfig, crawl_site
+from atp.web.extract import extract_html_files
+from atp.web.index import index_web_content, index_web_text
 from atp.web.scrape import scrape_url
 from atp.web.search import search_urls
 
@@ -24,6 +34,10 @@ app = typer.Typer(no_args_is_help=True)
 DEFAULT_CHROMA_DIR = Path("data/chroma")
 DEFAULT_OUTPUTS_DIR = Path("outputs")
 DEFAULT_DOCS_DIR = Path("docs")
+DEFAULT_ARTIFACTS_DIR = DEFAULT_OUTPUTS_DIR / "artifacts"
+# giới hạn giữ lại mặc định cho artifact store (prune sau mỗi lệnh ghi)
+DEFAULT_ARTIFACTS_MAX_BYTES = 2 * 1024**3
+DEFAULT_ARTIFACTS_MAX_AGE_DAYS = 30.0
 
 
 def _write_text(path: Path, content: str):
@@ -31,9 +45,22 @@ def _write_text(path: Path, content: str):
     path.write_text(content, encoding="utf-8")
 
 
-def _write_json(path: Path, obj):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+def _store(artifacts_dir: Path) -> ArtifactStore:
+    return ArtifactStore(
+        artifacts_dir,
+        max_bytes=DEFAULT_ARTIFACTS_MAX_BYTES,
+        max_age_days=DEFAULT_ARTIFACTS_MAX_AGE_DAYS,
+    )
+
+
+def _save_debug(store: ArtifactStore, run_id: str, result: QueryResult):
+    store.put_text(result.question, name="question", run_id=run_id)
+    store.put_text(result.answer, name="answer", run_id=run_id)
+    store.put_text("\n\n---\n\n".join(h.page_content for h in result.hits), name="context", run_id=run_id)
+    store.put_text(json.dumps(result.sources(), ensure_ascii=False, indent=2), name="hits", run_id=run_id)
+    stats = {k: v for k, v in result.to_dict().items() if k in ("tokens", "timings")}
+    store.put_text(json.dumps(stats, indent=2), name="stats", run_id=run_id)
+    store.prune()
 
 
 @app.command()
@@ -52,7 +79,7 @@ def web_search(
 @app.command()
 def web_scrape(
     url: str = typer.Argument(..., help="URL cần lấy"),
-    out_dir: Path = typer.Option(DEFAULT_OUTPUTS_DIR, help="Thư mục output"),
+    artifacts_dir: Path = typer.Option(DEFAULT_ARTIFACTS_DIR, help="Thư mục artifact store"),
     allowed_domain: Optional[List[str]] = typer.Option(
         None, help="Allowlist domain (lặp nhiều lần)"
     ),
@@ -64,42 +91,178 @@ def web_scrape(
     ),
     timeout_ms: int = typer.Option(30000, help="Timeout (ms)"),
 ):
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    async def _run():
-        r = await scrape_url(
+    r = asyncio.run(
+        scrape_url(
             url,
             allowed_domains=allowed_domain,
             headless=headless,
             timeout_ms=timeout_ms,
             content_selector=content_selector,
         )
-        _write_text(out_dir / "page.html", r.html)
-        _write_text(out_dir / "page.txt", r.text)
-        print(f"[green]OK[/green] Saved: {out_dir/'page.html'} and {out_dir/'page.txt'}")
+    )
 
-    asyncio.run(_run())
+    store = _store(artifacts_dir)
+    run_id = new_run_id()
+    html_ref = store.put_text(r.html, name="page.html", run_id=run_id, url=url)
+    text_ref = store.put_text(r.text, name="page.txt", run_id=run_id, url=url)
+    store.prune()
+    print(f"[green]OK[/green] run_id={run_id}")
+    print(f"  html: {html_ref.digest} ({html_ref.size} -> {html_ref.stored_size} bytes)")
+    print(f"  text: {text_ref.digest} ({text_ref.size} -> {text_ref.stored_size} bytes)")
 
 
 @app.command()
-def web_index(
-    text_path: Path = typer.Option(
-        Path("outputs/page.txt"), help="Đường dẫn file text đã scrape"
+def web_extract(
+    paths: List[Path] = typer.Argument(..., help="File .html hoặc thư mục chứa file .html/.htm"),
+    out_dir: Path = typer.Option(DEFAULT_OUTPUTS_DIR / "extracted", help="Thư mục ghi file .txt"),
+    content_selector: Optional[str] = typer.Option(
+        None, help='CSS selector lấy nội dung chính, ví dụ: "article"'
+    ),
+    workers: int = typer.Option(0, help="Số process song song (0 = số CPU)"),
+):
+    pairs = []
+    for p in paths:
+        if p.is_dir():
+            for f in sorted(p.rglob("*")):
+                if f.is_file() and f.suffix.lower() in (".html", ".htm"):
+                    pairs.append((f, out_dir / f.relative_to(p).with_suffix(".txt")))
+        elif p.is_file():
+            pairs.append((p, out_dir / p.with_suffix(".txt").name))
+        else:
+            raise typer.BadParameter(f"Không tìm thấy: {p}")
+    if not pairs:
+        raise typer.BadParameter("Không có file HTML nào")
+
+    # 2 file nguồn khác nhau ra cùng 1 file .txt (vd: x/page.html và y/page.html, a.html và a.htm)
+    # => các worker ghi đè lẫn nhau; cùng 1 file truyền 2 lần thì chỉ trích 1 lần
+    by_dst: dict = {}
+    unique = []
+    for src, dst in pairs:
+        prev = by_dst.setdefault(dst.resolve(), src)
+        if prev is src:
+            unique.append((src, dst))
+        elif prev.resolve() != src.resolve():
+            raise typer.BadParameter(f"{prev} và {src} cùng ghi ra {dst} - hãy trích riêng với --out-dir khác")
+    pairs = unique
+
+    for src, dst, lines in extract_html_files(pairs, content_selector, workers=workers or None):
+        print(f"  {src} -> {dst} ({lines} dòng)")
+    print(f"[green]OK[/green] extracted {len(pairs)} file -> {out_dir}")
+
+
+@app.command()
+def web_crawl(
+    seeds: Optional[List[str]] = typer.Argument(None, help="URL bắt đầu crawl"),
+    sitemap: Optional[List[str]] = typer.Option(None, help="URL sitemap.xml để seed (lặp nhiều lần)"),
+    allowed_domain: Optional[List[str]] = typer.Option(
+        None, help="Allowlist domain (lặp nhiều lần, mặc định = host của seeds)"
     ),
+    chroma_dir: Path = typer.Option(Path("data/chroma_web"), help="Chroma persist dir"),
+    embed_model: str = typer.Option("embeddinggemma", help="Ollama embedding model"),
+    frontier_db: Path = typer.Option(DEFAULT_FRONTIER_DB, help="SQLite frontier (chạy lại = resume)"),
+    max_pages: int = typer.Option(200, help="Số request trang tối đa cho lần chạy này"),
+    max_depth: int = typer.Option(3, help="Độ sâu link tối đa tính từ seed"),
+    concurrency: int = typer.Option(8, help="Tổng số request đồng thời (trên mọi host)"),
+    per_host: int = typer.Option(2, help="Số request đồng thời tối đa mỗi host"),
+    delay: float = typer.Option(1.0, help="Khoảng cách tối thiểu giữa 2 request tới 1 host (giây)"),
+    render: bool = typer.Option(False, help="Render bằng Chromium (chậm hơn, cho site cần JS)"),
+    user_agent: str = typer.Option(DEFAULT_USER_AGENT, help="User-Agent (dùng cả cho robots.txt)"),
+    content_selector: Optional[str] = typer.Option(
+        None, help='CSS selector lấy nội dung chính, ví dụ: "article"'
+    ),
+    chunk_size: int = typer.Option(DEFAULT_CHUNK_SIZE, help="Kích thước chunk (ký tự)"),
+    chunk_overlap: int = typer.Option(DEFAULT_CHUNK_OVERLAP, help="Độ chồng lấn giữa các chunk"),
+    timeout_ms: int = typer.Option(30000, help="Timeout mỗi request (ms)"),
+):
+    """
+    Crawl cả site (tôn trọng robots.txt, giới hạn tốc độ theo host) và index thẳng vào Chroma.
+    Dừng giữa chừng (Ctrl+C) rồi chạy lại cùng --frontier-db sẽ crawl tiếp.
+    """
+    if not seeds and not sitemap:
+        raise typer.BadParameter("Cần ít nhất 1 seed URL hoặc --sitemap")
+
+    config = CrawlConfig(
+        allowed_domains=allowed_domain or (),
+        max_pages=max_pages,
+        max_depth=max_depth,
+        concurrency=concurrency,
+        per_host=per_host,
+        delay_s=delay,
+        render=render,
+        user_agent=user_agent,
+        timeout_ms=timeout_ms,
+        content_selector=content_selector,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+    last = [0]
+
+    def progress(s):
+        if s.fetched - last[0] >= 10:
+            last[0] = s.fetched
+            print(
+                f"  fetched={s.fetched} indexed={s.indexed_pages} ({s.indexed_chunks} chunks) "
+                f"skipped={s.skipped} failed={s.failed} {s.pages_per_min:.0f} trang/phút"
+            )
+
+    try:
+        stats = asyncio.run(
+            crawl_site(
+                seeds or [],
+                chroma_dir,
+                embed_model=embed_model,
+                sitemaps=sitemap or [],
+                frontier_db=frontier_db,
+                config=config,
+                progress=progress,
+            )
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    print(f"[green]OK[/green] {json.dumps(stats.to_dict(), ensure_ascii=False)}")
+
+
+@app.command()
+def web_index(
     url: str = typer.Option(..., help="URL nguồn để gắn metadata"),
+    text_path: Optional[Path] = typer.Option(None, help="Đường dẫn file text đã scrape"),
+    artifact: Optional[str] = typer.Option(
+        None, help="Digest (hoặc prefix) của artifact text do web-scrape trả về"
+    ),
+    artifacts_dir: Path = typer.Option(DEFAULT_ARTIFACTS_DIR, help="Thư mục artifact store"),
     chroma_dir: Path = typer.Option(DEFAULT_CHROMA_DIR, help="Chroma persist dir"),
     embed_model: str = typer.Option("embeddinggemma", help="Ollama embedding model"),
+    chunk_size: int = typer.Option(DEFAULT_CHUNK_SIZE, help="Kích thước chunk (ký tự)"),
+    chunk_overlap: int = typer.Option(DEFAULT_CHUNK_OVERLAP, help="Độ chồng lấn giữa các chunk"),
 ):
-    if not text_path.exists():
-        raise typer.BadParameter(f"Không thấy file: {text_path}")
+    if (text_path is None) == (artifact is None):
+        raise typer.BadParameter("Chọn đúng 1 nguồn: hoặc --text-path hoặc --artifact")
 
     chroma_dir.mkdir(parents=True, exist_ok=True)
-    n = index_web_text(
-        text_path=text_path,
-        chroma_dir=chroma_dir,
-        url=url,
-        embed_model=embed_model,
-    )
+    if artifact is not None:
+        try:
+            text = _store(artifacts_dir).get_text(artifact)
+        except KeyError as e:
+            raise typer.BadParameter(str(e))
+        n = index_web_content(
+            text=text,
+            chroma_dir=chroma_dir,
+            url=url,
+            embed_model=embed_model,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+        )
+    else:
+        if not text_path.exists():
+            raise typer.BadParameter(f"Không thấy file: {text_path}")
+        n = index_web_text(
+            text_path=text_path,
+            chroma_dir=chroma_dir,
+            url=url,
+            embed_model=embed_model,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+        )
     print(f"[green]OK[/green] Added {n} chunks from web text into {chroma_dir}")
 
 
@@ -108,6 +271,8 @@ def rag_ingest(
     docs_dir: Path = typer.Option(DEFAULT_DOCS_DIR, help="Thư mục chứa PDF"),
     chroma_dir: Path = typer.Option(DEFAULT_CHROMA_DIR, help="Chroma persist dir"),
     embed_model: str = typer.Option("embeddinggemma", help="Ollama embedding model"),
+    chunk_size: int = typer.Option(DEFAULT_CHUNK_SIZE, help="Kích thước chunk (ký tự)"),
+    chunk_overlap: int = typer.Option(DEFAULT_CHUNK_OVERLAP, help="Độ chồng lấn giữa các chunk"),
     dump_text: bool = typer.Option(False, help="Xuất text PDF ra file để kiểm tra"),
     out_dir: Path = typer.Option(DEFAULT_OUTPUTS_DIR, help="Thư mục output (khi dump_text)"),
 ):
@@ -116,7 +281,13 @@ def rag_ingest(
         raise typer.BadParameter(f"Không thấy PDF trong {docs_dir}")
 
     chroma_dir.mkdir(parents=True, exist_ok=True)
-    n = build_vectorstore_from_pdfs(pdfs, chroma_dir, embed_model=embed_model)
+    n = build_vectorstore_from_pdfs(
+        pdfs,
+        chroma_dir,
+        embed_model=embed_model,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
     print(f"[green]OK[/green] Indexed {n} chunks into {chroma_dir}")
 
     if dump_text:
@@ -132,35 +303,155 @@ def rag_query(
     chroma_dir: Path = typer.Option(DEFAULT_CHROMA_DIR, help="Chroma persist dir"),
     embed_model: str = typer.Option("embeddinggemma", help="Ollama embedding model"),
     chat_model: str = typer.Option("qwen3:1.7b", help="Ollama chat model"),
-    top_k: int = typer.Option(4, help="Số chunk truy hồi"),
-    out_dir: Path = typer.Option(DEFAULT_OUTPUTS_DIR, help="Thư mục output debug"),
+    top_k: int = typer.Option(DEFAULT_TOP_K, help="Số chunk truy hồi"),
+    artifacts_dir: Path = typer.Option(DEFAULT_ARTIFACTS_DIR, help="Thư mục artifact store (debug)"),
     save_debug: bool = typer.Option(True, help="Lưu context/answer/hits để debug"),
+    backend: str = typer.Option(
+        "chroma", help='"chroma" hoặc "compact" (khi đó --chroma-dir là thư mục compact index)'
+    ),
 ):
-    ans = answer_query(
+    result = run_query(
         question=question,
         persist_dir=chroma_dir,
         embed_model=embed_model,
         chat_model=chat_model,
         top_k=top_k,
+        backend=backend,
     )
-    print(ans)
+    print(result.answer)
 
     if save_debug:
-        hits = retrieve_hits(
-            question=question,
-            persist_dir=chroma_dir,
+        run_id = new_run_id()
+        _save_debug(_store(artifacts_dir), run_id, result)
+        print(f"[green]OK[/green] Saved debug as run_id={run_id} in {artifacts_dir}")
+
+
+@app.command()
+def rag_sweep(
+    corpus_dir: Path = typer.Option(DEFAULT_DOCS_DIR, help="Thư mục corpus (PDF/.txt/.md)"),
+    questions: Path = typer.Option(..., help="JSONL câu hỏi có nhãn (question, answers/sources)"),
+    chunk_size: List[int] = typer.Option([500, 1000, 1500], help="Lưới chunk_size (lặp nhiều lần)"),
+    chunk_overlap: List[int] = typer.Option([0, 200], help="Lưới chunk_overlap (lặp nhiều lần)"),
+    top_k: List[int] = typer.Option([2, 4, 8], help="Lưới top_k (lặp nhiều lần)"),
+    embed_model: str = typer.Option("embeddinggemma", help="Ollama embedding model"),
+    cache: Path = typer.Option(DEFAULT_EMBED_CACHE, help="SQLite cache embedding"),
+    out: Optional[Path] = typer.Option(None, help="Ghi kết quả ra .json hoặc .csv"),
+):
+    """
+    Quét tham số chunking/top_k: recall@k, MRR so với số chunk, thời gian embed,
+    dung lượng index và số token prompt trung bình.
+    """
+    from rich.table import Table
+
+    if not questions.exists():
+        raise typer.BadParameter(f"Không thấy file: {questions}")
+
+    def _progress(r):
+        print(f"  size={r.chunk_size} overlap={r.chunk_overlap} k={r.top_k}: recall={r.recall} mrr={r.mrr}")
+
+    try:
+        rows = run_sweep(
+            corpus_dir,
+            questions,
+            chunk_sizes=chunk_size,
+            chunk_overlaps=chunk_overlap,
+            top_ks=top_k,
             embed_model=embed_model,
-            top_k=top_k,
-        )
-        out_dir.mkdir(parents=True, exist_ok=True)
-        _write_text(out_dir / "last_question.txt", question)
-        _write_text(out_dir / "last_answer.txt", ans)
-        _write_text(out_dir / "last_context.txt", "\n\n---\n\n".join(h.page_content for h in hits))
-        _write_json(
-            out_dir / "last_hits.json",
-            [{"metadata": h.metadata, "preview": h.page_content[:400]} for h in hits],
+            cache_path=cache,
+            progress=_progress,
         )
-        print(f"[green]OK[/green] Saved debug to {out_dir}")
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+    table = Table(title=f"rag-sweep ({rows[0].questions if rows else 0} câu hỏi)")
+    cols = [
+        "chunk_size",
+        "chunk_overlap",
+        "top_k",
+        "chunks",
+        "embed_s",
+        "index_bytes",
+        "recall",
+        "mrr",
+        "avg_prompt_tokens",
+    ]
+    for c in cols:
+        table.add_column(c, justify="right")
+    for r in rows:
+        d = r.to_dict()
+        table.add_row(*(str(d[c]) for c in cols))
+    print(table)
+
+    if out is not None:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == ".csv":
+            import csv
+
+            with open(out, "w", newline="", encoding="utf-8") as f:
+                w = csv.DictWriter(f, fieldnames=list(rows[0].to_dict()) if rows else cols)
+                w.writeheader()
+                w.writerows(r.to_dict() for r in rows)
+        else:
+            _write_text(out, json.dumps([r.to_dict() for r in rows], ensure_ascii=False, indent=2))
+        print(f"[green]OK[/green] Saved sweep results to {out}")
+
+
+@app.command()
+def compact_build(
+    out_dir: Path = typer.Argument(..., help="Thư mục compact index, ví dụ data/compact_docs"),
+    chroma_dir: Path = typer.Option(DEFAULT_CHROMA_DIR, help="Chroma persist dir nguồn"),
+    dtype: str = typer.Option("float16", help='"float16" (exact) hoặc "int8" (quét int8 + re-rank)'),
+    embed_model: Optional[str] = typer.Option(
+        None, help="Embed model đã dùng (mặc định đọc từ atp_index.json)"
+    ),
+):
+    """
+    Build compact index (mmap float16/int8) từ Chroma, dùng với rag-query --backend compact.
+    """
+    try:
+        m = build_compact_index(chroma_dir, out_dir, dtype=dtype, embed_model=embed_model)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    print(f"[green]OK[/green] Built {dtype} index: {m['count']} vectors x {m['dimension']} -> {out_dir}")
+
+
+@app.command()
+def kb_export(
+    out: Path = typer.Argument(..., help="File snapshot đầu ra, ví dụ kb/docs.atpkb"),
+    chroma_dir: Path = typer.Option(DEFAULT_CHROMA_DIR, help="Chroma persist dir"),
+    embed_model: Optional[str] = typer.Option(
+        None, help="Embed model đã dùng (mặc định đọc từ atp_index.json)"
+    ),
+):
+    """
+    Xuất collection (text + metadata + vector) thành 1 snapshot nén, có checksum.
+    """
+    try:
+        m = export_snapshot(chroma_dir, out, embed_model=embed_model)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    print(
+        f"[green]OK[/green] Exported {m['count']} chunks ({m['embed_model']}, dim={m['dimension']}) "
+        f"to {out} ({m['bundle_bytes']} bytes)"
+    )
+
+
+@app.command()
+def kb_import(
+    bundle: Path = typer.Argument(..., help="File snapshot .atpkb"),
+    chroma_dir: Path = typer.Option(DEFAULT_CHROMA_DIR, help="Chroma persist dir"),
+    embed_model: str = typer.Option("embeddinggemma", help="Embed model node này dùng để query"),
+):
+    """
+    Nạp snapshot thẳng vào Chroma, không embed lại. Từ chối nếu embed model không khớp.
+    """
+    if not bundle.exists():
+        raise typer.BadParameter(f"Không thấy file: {bundle}")
+    try:
+        r = import_snapshot(bundle, chroma_dir, embed_model=embed_model)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    print(f"[green]OK[/green] Loaded {r['loaded']} chunks into {chroma_dir} (dim={r['dimension']})")
 
 
 @app.command()
@@ -175,17 +466,20 @@ def run(
     chroma_dir: Path = typer.Option(DEFAULT_CHROMA_DIR, help="Chroma persist dir"),
     embed_model: str = typer.Option("embeddinggemma", help="Ollama embedding model"),
     chat_model: str = typer.Option("qwen3:1.7b", help="Ollama chat model"),
-    out_dir: Path = typer.Option(DEFAULT_OUTPUTS_DIR, help="Thư mục output"),
+    artifacts_dir: Path = typer.Option(DEFAULT_ARTIFACTS_DIR, help="Thư mục artifact store"),
     headless: bool = typer.Option(True, help="Web headless (dùng --no-headless để mở browser)"),
-    top_k: int = typer.Option(4, help="Số chunk truy hồi"),
+    top_k: int = typer.Option(DEFAULT_TOP_K, help="Số chunk truy hồi"),
 ):
     """
     Pipeline 1 lệnh:
     - Nếu pdf_dir: ingest PDF -> query
-    - Nếu url: scrape -> save outputs/page.* -> index outputs/page.txt -> query (lọc đúng url)
+    - Nếu url: scrape -> lưu html/text vào artifact store -> index text -> query (lọc đúng url)
+
+    Mỗi lần chạy có run_id riêng nên chạy song song không ghi đè nhau.
     """
     chroma_dir.mkdir(parents=True, exist_ok=True)
-    out_dir.mkdir(parents=True, exist_ok=True)
+    store = _store(artifacts_dir)
+    run_id = new_run_id()
 
     if (pdf_dir is None) == (url is None):
         raise typer.BadParameter("Chọn đúng 1 nguồn: hoặc --pdf-dir hoặc --url")
@@ -199,43 +493,42 @@ def run(
         n = build_vectorstore_from_pdfs(pdfs, chroma_dir, embed_model=embed_model)
         print(f"[green]OK[/green] Indexed {n} chunks from PDFs into {chroma_dir}")
 
-        ans = answer_query(
+        result = run_query(
             question=question,
             persist_dir=chroma_dir,
             embed_model=embed_model,
             chat_model=chat_model,
             top_k=top_k,
         )
-        print(ans)
-        _write_text(out_dir / "last_question.txt", question)
-        _write_text(out_dir / "last_answer.txt", ans)
+        print(result.answer)
+        _save_debug(store, run_id, result)
+        print(f"[green]OK[/green] run_id={run_id}")
         return
 
     # --- URL mode ---
-    async def _scrape():
-        r = await scrape_url(
+    r = asyncio.run(
+        scrape_url(
             url,
             allowed_domains=allowed_domain,
             headless=headless,
             content_selector=content_selector,
         )
-        _write_text(out_dir / "page.html", r.html)
-        _write_text(out_dir / "page.txt", r.text)
-
-    asyncio.run(_scrape())
+    )
+    store.put_text(r.html, name="page.html", run_id=run_id, url=url)
+    store.put_text(r.text, name="page.txt", run_id=run_id, url=url)
 
-    added = add_textfile_to_vectorstore(
-        text_path=out_dir / "page.txt",
-        persist_dir=chroma_dir,
+    added = index_web_content(
+        text=r.text,
+        chroma_dir=chroma_dir,
+        url=url,
         embed_model=embed_model,
-        metadata={"source_type": "web", "url": url},
     )
     print(f"[green]OK[/green] Added {added} chunks from web into {chroma_dir}")
 
     # QUAN TRỌNG: Chroma where cần 1 operator -> dùng $and
     where = {"$and": [{"source_type": "web"}, {"url": url}]}
 
-    ans = answer_query(
+    result = run_query(
         question=question,
         persist_dir=chroma_dir,
         embed_model=embed_model,
@@ -243,6 +536,64 @@ def run(
         top_k=top_k,
         where=where,
     )
-    print(ans)
-    _write_text(out_dir / "last_question.txt", question)
-    _write_text(out_dir / "last_answer.txt", ans)
+    print(result.answer)
+    _save_debug(store, run_id, result)
+    print(f"[green]OK[/green] run_id={run_id}")
+
+
+@app.command()
+def artifact_list(
+    run_id: Optional[str] = typer.Option(None, help="Lọc theo run_id"),
+    url: Optional[str] = typer.Option(None, help="Lọc theo URL"),
+    limit: int = typer.Option(50, help="Số dòng tối đa"),
+    artifacts_dir: Path = typer.Option(DEFAULT_ARTIFACTS_DIR, help="Thư mục artifact store"),
+):
+    for a in _store(artifacts_dir).find(run_id=run_id, url=url, limit=limit):
+        print(f"{a.digest[:12]}  {a.run_id}  {a.name:<12} {a.size:>9}B  {a.url or ''}")
+
+
+@app.command()
+def artifact_get(
+    digest: str = typer.Argument(..., help="Digest hoặc prefix"),
+    out: Optional[Path] = typer.Option(None, help="Ghi ra file thay vì in ra màn hình"),
+    artifacts_dir: Path = typer.Option(DEFAULT_ARTIFACTS_DIR, help="Thư mục artifact store"),
+):
+    try:
+        data = _store(artifacts_dir).get_bytes(digest)
+    except KeyError as e:
+        raise typer.BadParameter(str(e))
+    if out is None:
+        typer.echo(data.decode("utf-8", errors="replace"))
+        return
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_bytes(data)
+    print(f"[green]OK[/green] Wrote {len(data)} bytes to {out}")
+
+
+@app.command()
+def artifact_prune(
+    max_bytes: Optional[int] = typer.Option(None, help="Tổng dung lượng nén tối đa"),
+    max_age_days: Optional[float] = typer.Option(None, help="Xoá run cũ hơn N ngày"),
+    max_runs: Optional[int] = typer.Option(None, help="Chỉ giữ N run mới nhất"),
+    artifacts_dir: Path = typer.Option(DEFAULT_ARTIFACTS_DIR, help="Thư mục artifact store"),
+):
+    store = _store(artifacts_dir)
+    r = store.prune(max_bytes=max_bytes, max_age_days=max_age_days, max_runs=max_runs)
+    print(f"[green]OK[/green] Dropped {r['dropped_runs']} runs, deleted {r['deleted_blobs']} blobs")
+    print(store.stats())
+
+
+@app.command()
+def job_worker(
+    jobs_db: Path = typer.Option(DEFAULT_JOBS_DB, help="SQLite job queue"),
+    poll_interval: float = typer.Option(1.0, help="Chu kỳ poll khi hàng đợi rỗng (giây)"),
+    exit_when_idle: bool = typer.Option(False, help="Thoát khi hết job"),
+):
+    """
+    Chạy 1 worker xử lý job nền (ingest/index) do MCP server đẩy vào.
+    Có thể chạy nhiều worker song song trên cùng jobs_db.
+    """
+    import logging
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    run_worker(jobs_db, poll_interval=poll_interval, exit_when_idle=exit_when_idle)
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import List, Optional
+
+DEFAULT_JOBS_DB = Path("data/jobs.sqlite3")
+
+# job "running" mà không có heartbeat quá lâu => coi như worker đã chết, đưa lại vào hàng đợi
+DEFAULT_STALE_AFTER_S = 120.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINAL_STATUSES = (DONE, FAILED, CANCELLED)
+
+# worker chỉ được ghi job còn thuộc mình: job bị claim() coi là stale rồi giao cho worker khác
+# thì worker cũ không được ghi đè progress/checkpoint/kết quả nữa
+_OWNED_BY = "id = ? AND worker = ? AND status = ?"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobLost(Exception):
+    """Job đã bị đưa lại hàng đợi (stale) và có thể đang thuộc worker khác."""
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    Hàng đợi job bền vững trên SQLite (nhiều process cùng dùng được).
+
+    Mỗi job có:
+      - params: tham số đầu vào (JSON)
+      - checkpoint: trạng thái đã hoàn thành (vd: chunks_done) để resume
+      - progress: số liệu hiển thị (files/chunks done, ...)
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_JOBS_DB):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as con:
+            con.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    checkpoint TEXT NOT NULL DEFAULT '{}',
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    heartbeat_at REAL,
+                    finished_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, id);
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        for k in ("params", "checkpoint", "progress", "result"):
+            job[k] = json.loads(job[k]) if job[k] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        job["progress"] = _with_rates(job["progress"] or {})
+        return job
+
+    # ---------- client side ----------
+
+    def submit(self, kind: str, params: dict) -> dict:
+        with closing(self._connect()) as con:
+            cur = con.execute(
+                "INSERT INTO jobs(kind, params, status, created_at) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(params, ensure_ascii=False), QUEUED, time.time()),
+            )
+            job_id = cur.lastrowid
+        return self.get(job_id)
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, status: Optional[str] = None, limit: int = 20) -> List[dict]:
+        sql = "SELECT * FROM jobs"
+        params: tuple = ()
+        if status:
+            sql += " WHERE status = ?"
+            params = (status,)
+        sql += " ORDER BY id DESC LIMIT ?"
+        with closing(self._connect()) as con:
+            rows = con.execute(sql, (*params, limit)).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def cancel(self, job_id: int) -> Optional[dict]:
+        """Job đang chờ => huỷ ngay; job đang chạy => đặt cờ, worker dừng sau batch hiện tại."""
+        now = time.time()
+        with closing(self._connect()) as con:
+            con.execute(
+                "UPDATE jobs SET status = ?, cancel_requested = 1, finished_at = ? "
+                "WHERE id = ? AND status = ?",
+                (CANCELLED, now, job_id, QUEUED),
+            )
+            con.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+                (job_id, RUNNING),
+            )
+        return self.get(job_id)
+
+    # ---------- worker side ----------
+
+    def claim(self, worker: str, stale_after_s: float = DEFAULT_STALE_AFTER_S) -> Optional[dict]:
+        now = time.time()
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            # job của worker đã chết => đưa lại hàng đợi, giữ nguyên checkpoint để resume
+            con.execute(
+                "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, now - stale_after_s),
+            )
+            # Chroma PersistentClient không an toàn khi nhiều process cùng ghi 1 thư mục
+            # => bỏ qua job có chroma_dir đang được job khác ghi, lấy job kế tiếp
+            row = con.execute(
+                "SELECT id FROM jobs q WHERE status = ? AND NOT EXISTS ("
+                "SELECT 1 FROM jobs r WHERE r.status = ? "
+                "AND json_extract(r.params, '$.chroma_dir') = json_extract(q.params, '$.chroma_dir')"
+                ") ORDER BY id LIMIT 1",
+                (QUEUED, RUNNING),
+            ).fetchone()
+            if row is None:
+                con.execute("COMMIT")
+                return None
+            con.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, "
+                "started_at = COALESCE(started_at, ?), heartbeat_at = ? WHERE id = ?",
+                (RUNNING, worker, now, now, row["id"]),
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            # BEGIN IMMEDIATE hết timeout => chưa có transaction, giữ nguyên lỗi "database is locked"
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        return self.get(row["id"])
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """Trả về True nếu client đã yêu cầu huỷ."""
+        with closing(self._connect()) as con:
+            con.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE {_OWNED_BY}",
+                (time.time(), job_id, worker, RUNNING),
+            )
+            row = con.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def update(self, job_id: int, worker: str, progress: dict, checkpoint: Optional[dict] = None) -> bool:
+        """
+        Ghi progress (+ checkpoint nếu có). Trả về True nếu client đã yêu cầu huỷ.
+        Raise JobLost nếu job không còn thuộc worker này.
+        """
+        now = time.time()
+        with closing(self._connect()) as con:
+            if checkpoint is None:
+                cur = con.execute(
+                    f"UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE {_OWNED_BY}",
+                    (json.dumps(progress), now, job_id, worker, RUNNING),
+                )
+            else:
+                cur = con.execute(
+                    f"UPDATE jobs SET progress = ?, checkpoint = ?, heartbeat_at = ? WHERE {_OWNED_BY}",
+                    (json.dumps(progress), json.dumps(checkpoint), now, job_id, worker, RUNNING),
+                )
+            if cur.rowcount == 0:
+                raise JobLost(job_id)
+            row = con.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def finish(
+        self,
+        job_id: int,
+        worker: str,
+        status: str,
+        result: Optional[dict] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Trả về False nếu job không còn thuộc worker này (kết quả bị bỏ)."""
+        with closing(self._connect()) as con:
+            cur = con.execute(
+                f"UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE {_OWNED_BY}",
+                (
+                    status,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error,
+                    time.time(),
+                    job_id,
+                    worker,
+                    RUNNING,
+                ),
+            )
+        return cur.rowcount == 1
+
+
+def _with_rates(progress: dict) -> dict:
+    """Tính throughput + ETA từ progress của lần chạy hiện tại."""
+    done = progress.get("chunks_done")
+    total = progress.get("chunks_total")
+    started = progress.get("attempt_started_at")
+    base = progress.get("attempt_start_chunks", 0)
+    if done is None or not total or not started:
+        return progress
+
+    elapsed = max(progress.get("updated_at", time.time()) - started, 1e-6)
+    rate = (done - base) / elapsed
+    progress["chunks_per_s"] = round(rate, 3)
+    progress["eta_s"] = round((total - done) / rate, 1) if rate > 0 else None
+    return progress
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from atp.jobs.queue import (
+    CANCELLED,
+    DEFAULT_JOBS_DB,
+    DONE,
+    FAILED,
+    JobCancelled,
+    JobLost,
+    JobQueue,
+    worker_id,
+)
+from atp.rag.rag_core import DEFAULT_BATCH_SIZE, add_chunks_to_vectorstore, split_pdfs, split_text
+
+log = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL_S = 10.0
+
+
+def _index_chunks(queue: JobQueue, job: dict, chunks: List, params: dict) -> dict:
+    """Ghi chunks theo batch, lưu checkpoint sau mỗi batch => resume được từ batch kế tiếp."""
+    job_id = job["id"]
+    me = job["worker"]
+    start = (job["checkpoint"] or {}).get("chunks_done", 0)
+    total = len(chunks)
+
+    # file i được tính là xong khi chunk cuối của nó đã ghi
+    last_chunk_of: Dict[str, int] = {}
+    for i, c in enumerate(chunks):
+        last_chunk_of[str(c.metadata.get("source", ""))] = i
+    ends = sorted(last_chunk_of.values())
+
+    attempt_started = time.time()
+
+    def progress(done: int, _total: int):
+        now = time.time()
+        p = {
+            "files_done": sum(1 for e in ends if e < done),
+            "files_total": len(ends),
+            "chunks_done": done,
+            "chunks_total": total,
+            "attempt_started_at": attempt_started,
+            "attempt_start_chunks": start,
+            "updated_at": now,
+        }
+        if queue.update(job_id, me, p, {"chunks_done": done}):
+            raise JobCancelled()
+
+    progress(start, total)
+    add_chunks_to_vectorstore(
+        chunks,
+        Path(params["chroma_dir"]),
+        embed_model=params["embed_model"],
+        batch_size=params.get("batch_size", DEFAULT_BATCH_SIZE),
+        start=start,
+        progress=progress,
+        chunking={"chunk_size": params["chunk_size"], "chunk_overlap": params["chunk_overlap"]},
+    )
+    return {"indexed_chunks": total, "chroma_dir": params["chroma_dir"]}
+
+
+def _run_pdf_ingest(queue: JobQueue, job: dict) -> dict:
+    params = job["params"]
+    pdfs = [Path(p) for p in params["pdfs"]]
+    chunks = split_pdfs(pdfs, params["chunk_size"], params["chunk_overlap"])
+    result = _index_chunks(queue, job, chunks, params)
+    result["pdf_count"] = len(pdfs)
+    return result
+
+
+def _run_text_index(queue: JobQueue, job: dict) -> dict:
+    params = job["params"]
+    if params.get("text_artifact"):
+        from atp.store.artifacts import ArtifactStore
+
+        text = ArtifactStore(Path(params["artifacts_dir"])).get_text(params["text_artifact"])
+    else:
+        text = Path(params["text_path"]).read_text(encoding="utf-8")
+    chunks = split_text(
+        text,
+        params["chunk_size"],
+        params["chunk_overlap"],
+        metadata=params.get("metadata"),
+    )
+    return _index_chunks(queue, job, chunks, params)
+
+
+HANDLERS: Dict[str, Callable[[JobQueue, dict], dict]] = {
+    "pdf_ingest": _run_pdf_ingest,
+    "text_index": _run_text_index,
+}
+
+
+def run_job(queue: JobQueue, job: dict):
+    job_id = job["id"]
+    me = job["worker"]
+    stop = threading.Event()
+
+    # batch embed có thể lâu => heartbeat riêng để job không bị coi là "stale"
+    def _beat():
+        while not stop.wait(HEARTBEAT_INTERVAL_S):
+            queue.heartbeat(job_id, me)
+
+    beater = threading.Thread(target=_beat, daemon=True)
+    beater.start()
+    try:
+        handler = HANDLERS.get(job["kind"])
+        if handler is None:
+            raise ValueError(f"Không hỗ trợ job kind: {job['kind']}")
+        result = handler(queue, job)
+        if not queue.finish(job_id, me, DONE, result=result):
+            raise JobLost(job_id)
+        log.info("job %s done: %s", job_id, result)
+    except JobLost:
+        # worker khác đã nhận lại job => dừng, không ghi gì thêm
+        log.warning("job %s không còn thuộc worker %s => dừng", job_id, me)
+    except JobCancelled:
+        queue.finish(job_id, me, CANCELLED)
+        log.info("job %s cancelled", job_id)
+    except Exception as e:
+        queue.finish(job_id, me, FAILED, error=f"{e}\n{traceback.format_exc()}")
+        log.exception("job %s failed", job_id)
+    finally:
+        stop.set()
+
+
+def run_worker(
+    db_path: Path = DEFAULT_JOBS_DB,
+    poll_interval: float = 1.0,
+    exit_when_idle: bool = False,
+):
+    queue = JobQueue(db_path)
+    me = worker_id()
+    log.info("worker %s polling %s", me, db_path)
+    while True:
+        job = queue.claim(me)
+        if job is None:
+            if exit_when_idle:
+                return
+            time.sleep(poll_interval)
+            continue
+        log.info("worker %s running job %s (%s)", me, job["id"], job["kind"])
+        run_job(queue, job)
+
+
+def _worker_main(db_path: str):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    run_worker(Path(db_path))
+
+
+def start_workers(db_path: Path = DEFAULT_JOBS_DB, n: int = 1) -> List[multiprocessing.Process]:
+    """Chạy n worker process nền (daemon => tự tắt cùng process cha)."""
+    procs = []
+    for _ in range(n):
+        p = multiprocessing.Process(target=_worker_main, args=(str(db_path),), daemon=True)
+        p.start()
+        procs.append(p)
+    return procs
@@ -9,11 +9,16 @@ from typing import Optional
 
 from mcp.server.fastmcp import FastMCP
 
+from atp.jobs.queue import DEFAULT_JOBS_DB, DONE, FAILED, FINAL_STATUSES, JobQueue
+from atp.jobs.worker import start_workers
 from atp.rag.rag_core import (
-    add_textfile_to_vectorstore,
-    answer_query,
-    build_vectorstore_from_pdfs,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_TOP_K,
+    run_query,
 )
+from atp.store.artifacts import ArtifactStore, new_run_id
 from atp.web.scrape import scrape_url
 from atp.web.search import search_urls
 
@@ -28,6 +33,9 @@ logging.basicConfig(
 DEFAULT_CHROMA_DIR = Path("data/chroma")
 DEFAULT_OUTPUTS_DIR = Path("outputs")
 DEFAULT_DOCS_DIR = Path("docs")
+DEFAULT_ARTIFACTS_DIR = DEFAULT_OUTPUTS_DIR / "artifacts"
+DEFAULT_ARTIFACTS_MAX_BYTES = 2 * 1024**3
+DEFAULT_ARTIFACTS_MAX_AGE_DAYS = 30.0
 
 # Stateless + JSON response là khuyến nghị cho streamable-http. :contentReference[oaicite:3]{index=3}
 mcp = FastMCP("ATP Tool Server", stateless_http=True, json_response=True)
@@ -37,6 +45,45 @@ def _ensure_dir(p: Path):
     p.mkdir(parents=True, exist_ok=True)
 
 
+def _store(artifacts_dir: str) -> ArtifactStore:
+    return ArtifactStore(
+        Path(artifacts_dir),
+        max_bytes=DEFAULT_ARTIFACTS_MAX_BYTES,
+        max_age_days=DEFAULT_ARTIFACTS_MAX_AGE_DAYS,
+    )
+
+
+def _submit_pdf_ingest(pdfs: list[Path], chroma_dir: Path, embed_model: str, jobs_db: str) -> dict:
+    return JobQueue(Path(jobs_db)).submit(
+        "pdf_ingest",
+        {
+            "pdfs": [str(p.resolve()) for p in pdfs],
+            "chroma_dir": str(chroma_dir.resolve()),
+            "embed_model": embed_model,
+            "chunk_size": DEFAULT_CHUNK_SIZE,
+            "chunk_overlap": DEFAULT_CHUNK_OVERLAP,
+            "batch_size": DEFAULT_BATCH_SIZE,
+        },
+    )
+
+
+async def _wait_job(queue: JobQueue, job: dict, wait_s: float) -> dict:
+    """Poll job tới khi xong hoặc hết wait_s (không chặn event loop), trả về trạng thái mới nhất."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait_s
+    while job["status"] not in FINAL_STATUSES and loop.time() < deadline:
+        await asyncio.sleep(0.5)
+        job = queue.get(job["id"])
+    return job
+
+
+def _job_view(job: Optional[dict]) -> dict:
+    if job is None:
+        return {"ok": False, "error": "Không thấy job"}
+    keys = ("id", "kind", "status", "progress", "result", "error", "attempts", "created_at", "finished_at")
+    return {"ok": True, **{k: job[k] for k in keys}}
+
+
 def _web_where(url: str) -> dict:
     # Chroma where cần 1 operator => dùng $and
     return {"$and": [{"source_type": "web"}, {"url": url}]}
@@ -59,15 +106,13 @@ async def atp_web_scrape(
     content_selector: Optional[str] = None,
     headless: bool = True,
     timeout_ms: int = 30000,
-    out_dir: str = str(DEFAULT_OUTPUTS_DIR),
+    artifacts_dir: str = str(DEFAULT_ARTIFACTS_DIR),
+    run_id: Optional[str] = None,
 ) -> dict:
     """
-    Scrape URL (Playwright) -> lưu outputs/page.html + outputs/page.txt
-    Trả về preview text + đường dẫn file đã lưu.
+    Scrape URL (Playwright) -> lưu html + text vào artifact store (nén, theo hash nội dung).
+    Trả về preview text + artifact handle (digest) thay cho đường dẫn file cố định.
     """
-    out = Path(out_dir)
-    _ensure_dir(out)
-
     allowed = [allowed_domain] if allowed_domain else None
     r = await scrape_url(
         url,
@@ -77,45 +122,84 @@ async def atp_web_scrape(
         content_selector=content_selector,
     )
 
-    html_path = out / "page.html"
-    txt_path = out / "page.txt"
-    html_path.write_text(r.html, encoding="utf-8")
-    txt_path.write_text(r.text, encoding="utf-8")
+    store = _store(artifacts_dir)
+    run_id = run_id or new_run_id()
+    html_ref = store.put_text(r.html, name="page.html", run_id=run_id, url=url)
+    text_ref = store.put_text(r.text, name="page.txt", run_id=run_id, url=url)
+    store.prune()
 
     preview = (r.text or "")[:2000]
     return {
         "url": url,
-        "saved_html": str(html_path),
-        "saved_text": str(txt_path),
+        "run_id": run_id,
+        "html_artifact": html_ref.to_dict(),
+        "text_artifact": text_ref.to_dict(),
         "text_len": len(r.text or ""),
         "text_preview": preview,
     }
 
 
 @mcp.tool()
-def atp_web_index(
+async def atp_web_index(
     url: str,
-    text_path: str = str(DEFAULT_OUTPUTS_DIR / "page.txt"),
+    text_artifact: Optional[str] = None,
+    text_path: Optional[str] = None,
+    artifacts_dir: str = str(DEFAULT_ARTIFACTS_DIR),
     chroma_dir: str = str(DEFAULT_CHROMA_DIR),
     embed_model: str = "embeddinggemma",
+    background: bool = True,
+    wait_s: float = 120.0,
+    jobs_db: str = str(DEFAULT_JOBS_DB),
 ) -> dict:
     """
-    Index outputs/page.txt vào Chroma, gắn metadata source_type=web, url=...
+    Index text vào Chroma, gắn metadata source_type=web, url=...
+    - text_artifact: digest (hoặc prefix) do atp_web_scrape trả về
+    - text_path: hoặc đường dẫn file text
+    Luôn ghi qua job queue (worker process) => không có 2 process cùng ghi 1 chroma_dir
+    và không chặn các tool khác (vd: atp_rag_query).
+    - background=True (mặc định): trả về job_id ngay (theo dõi bằng atp_job_status)
+    - background=False: chờ job tối đa wait_s rồi trả về added_chunks (chưa xong => trả job)
     """
-    tp = Path(text_path)
-    if not tp.exists():
+    if (text_artifact is None) == (text_path is None):
+        return {"ok": False, "error": "Chỉ chọn 1 nguồn: hoặc text_artifact hoặc text_path"}
+    if text_artifact is not None:
+        try:
+            text_artifact = _store(artifacts_dir).resolve(text_artifact)
+        except KeyError as e:
+            return {"ok": False, "error": str(e)}
+    elif not Path(text_path).exists():
         return {"ok": False, "error": f"Không thấy file text_path: {text_path}"}
 
     cd = Path(chroma_dir)
     _ensure_dir(cd)
-
-    added = add_textfile_to_vectorstore(
-        text_path=tp,
-        persist_dir=cd,
-        embed_model=embed_model,
-        metadata={"source_type": "web", "url": url},
+    queue = JobQueue(Path(jobs_db))
+    job = queue.submit(
+        "text_index",
+        {
+            "text_artifact": text_artifact,
+            "artifacts_dir": str(Path(artifacts_dir).resolve()),
+            "text_path": str(Path(text_path).resolve()) if text_path else None,
+            "metadata": {"source_type": "web", "url": url},
+            "chroma_dir": str(cd.resolve()),
+            "embed_model": embed_model,
+            "chunk_size": DEFAULT_CHUNK_SIZE,
+            "chunk_overlap": DEFAULT_CHUNK_OVERLAP,
+            "batch_size": DEFAULT_BATCH_SIZE,
+        },
     )
-    return {"ok": True, "added_chunks": added, "chroma_dir": str(cd), "url": url}
+    if background:
+        return {"ok": True, "job_id": job["id"], "status": job["status"], "url": url}
+
+    job = await _wait_job(queue, job, wait_s)
+    if job["status"] != DONE:
+        return {"ok": job["status"] != FAILED, "job": _job_view(job), "chroma_dir": str(cd), "url": url}
+    return {
+        "ok": True,
+        "job_id": job["id"],
+        "added_chunks": job["result"]["indexed_chunks"],
+        "chroma_dir": str(cd),
+        "url": url,
+    }
 
 
 @mcp.tool()
@@ -123,9 +207,11 @@ def atp_rag_ingest(
     docs_dir: str = str(DEFAULT_DOCS_DIR),
     chroma_dir: str = str(DEFAULT_CHROMA_DIR),
     embed_model: str = "embeddinggemma",
+    jobs_db: str = str(DEFAULT_JOBS_DB),
 ) -> dict:
     """
-    Ingest toàn bộ PDF trong docs_dir -> Chroma
+    Ingest toàn bộ PDF trong docs_dir -> Chroma (chạy nền bởi worker).
+    Trả về job_id ngay; dùng atp_job_status để xem tiến độ, atp_job_cancel để huỷ.
     """
     dd = Path(docs_dir)
     pdfs = sorted(dd.glob("*.pdf"))
@@ -135,8 +221,42 @@ def atp_rag_ingest(
     cd = Path(chroma_dir)
     _ensure_dir(cd)
 
-    n = build_vectorstore_from_pdfs(pdfs, cd, embed_model=embed_model)
-    return {"ok": True, "indexed_chunks": n, "pdf_count": len(pdfs), "chroma_dir": str(cd)}
+    job = _submit_pdf_ingest(pdfs, cd, embed_model, jobs_db)
+    return {
+        "ok": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "pdf_count": len(pdfs),
+        "chroma_dir": str(cd),
+    }
+
+
+@mcp.tool()
+def atp_job_status(job_id: int, jobs_db: str = str(DEFAULT_JOBS_DB)) -> dict:
+    """
+    Trạng thái job: status, progress (files/chunks done, chunks_per_s, eta_s), result/error.
+    """
+    return _job_view(JobQueue(Path(jobs_db)).get(job_id))
+
+
+@mcp.tool()
+def atp_job_list(
+    status: Optional[str] = None,
+    limit: int = 20,
+    jobs_db: str = str(DEFAULT_JOBS_DB),
+) -> list[dict]:
+    """
+    Liệt kê job gần nhất (lọc theo status: queued/running/done/failed/cancelled).
+    """
+    return [_job_view(j) for j in JobQueue(Path(jobs_db)).list(status=status, limit=limit)]
+
+
+@mcp.tool()
+def atp_job_cancel(job_id: int, jobs_db: str = str(DEFAULT_JOBS_DB)) -> dict:
+    """
+    Huỷ job. Job đang chạy sẽ dừng sau batch hiện tại (các batch đã ghi vẫn giữ nguyên).
+    """
+    return _job_view(JobQueue(Path(jobs_db)).cancel(job_id))
 
 
 @mcp.tool()
@@ -145,26 +265,29 @@ def atp_rag_query(
     chroma_dir: str = str(DEFAULT_CHROMA_DIR),
     embed_model: str = "embeddinggemma",
     chat_model: str = "qwen3:1.7b",
-    top_k: int = 4,
+    top_k: int = DEFAULT_TOP_K,
     url: Optional[str] = None,
+    backend: str = "chroma",
 ) -> dict:
     """
     Hỏi đáp RAG. Nếu có url => lọc retrieval theo đúng url (không lẫn nguồn).
+    backend="compact": chroma_dir là thư mục compact index (atp compact-build).
+    Trả về kèm sources (chunk id, score, metadata, preview), tokens và timings
+    => client không cần query lại để lấy nguồn.
     """
     where = _web_where(url) if url else None
-    ans = answer_query(
+    result = run_query(
         question=question,
         persist_dir=Path(chroma_dir),
         embed_model=embed_model,
         chat_model=chat_model,
         top_k=top_k,
         where=where,
+        backend=backend,
     )
-    return {
-        "answer": ans,
-        "filtered_by_url": url is not None,
-        "url": url,
-    }
+    out = result.to_dict()
+    out.update({"filtered_by_url": url is not None, "url": url})
+    return out
 
 
 @mcp.tool()
@@ -177,13 +300,16 @@ async def atp_run(
     chroma_dir: str = str(DEFAULT_CHROMA_DIR),
     embed_model: str = "embeddinggemma",
     chat_model: str = "qwen3:1.7b",
-    top_k: int = 4,
-    out_dir: str = str(DEFAULT_OUTPUTS_DIR),
+    top_k: int = DEFAULT_TOP_K,
+    artifacts_dir: str = str(DEFAULT_ARTIFACTS_DIR),
+    wait_s: float = 20.0,
+    jobs_db: str = str(DEFAULT_JOBS_DB),
 ) -> dict:
     """
     Pipeline 1 lệnh:
-    - pdf_dir: ingest PDF -> query
-    - url: scrape -> index -> query (lọc theo url)
+    - pdf_dir: đẩy job ingest PDF -> chờ tối đa wait_s -> query
+      (nếu job chưa xong: trả về job_id, hỏi lại bằng atp_rag_query khi job "done")
+    - url: scrape -> job index -> chờ tối đa wait_s -> query (lọc theo url)
     """
     cd = Path(chroma_dir)
     _ensure_dir(cd)
@@ -197,15 +323,32 @@ async def atp_run(
         if not pdfs:
             return {"ok": False, "error": f"Không thấy PDF trong {pdf_dir}"}
 
-        n = build_vectorstore_from_pdfs(pdfs, cd, embed_model=embed_model)
-        ans = answer_query(
+        job = _submit_pdf_ingest(pdfs, cd, embed_model, jobs_db)
+        job = await _wait_job(JobQueue(Path(jobs_db)), job, wait_s)
+
+        if job["status"] != DONE:
+            # chưa xong trong wait_s (hoặc lỗi) => trả job để client tự poll
+            return {"ok": job["status"] != FAILED, "mode": "pdf", "job": _job_view(job), "answer": None}
+
+        result = await asyncio.to_thread(
+            run_query,
             question=question,
             persist_dir=cd,
             embed_model=embed_model,
             chat_model=chat_model,
             top_k=top_k,
         )
-        return {"ok": True, "mode": "pdf", "indexed_chunks": n, "answer": ans}
+        qa = result.to_dict()
+        return {
+            "ok": True,
+            "mode": "pdf",
+            "job": _job_view(job),
+            "indexed_chunks": job["result"]["indexed_chunks"],
+            "answer": qa["answer"],
+            "sources": qa["sources"],
+            "tokens": qa["tokens"],
+            "timings": qa["timings"],
+        }
 
     # url mode
     scrape_result = await atp_web_scrape(
@@ -213,15 +356,23 @@ async def atp_run(
         allowed_domain=allowed_domain,
         content_selector=content_selector,
         headless=True,
-        out_dir=out_dir,
+        artifacts_dir=artifacts_dir,
     )
-    index_result = atp_web_index(
+    # index qua job queue như PDF mode => không ghi Chroma trong process MCP
+    index_result = await atp_web_index(
         url=url,
-        text_path=str(Path(out_dir) / "page.txt"),
+        text_artifact=scrape_result["text_artifact"]["digest"],
+        artifacts_dir=artifacts_dir,
         chroma_dir=chroma_dir,
         embed_model=embed_model,
+        background=False,
+        wait_s=wait_s,
+        jobs_db=jobs_db,
     )
-    ans_obj = atp_rag_query(
+    if "added_chunks" not in index_result:
+        return {"ok": index_result["ok"], "mode": "url", "scrape": scrape_result, "index": index_result, "answer": None}
+    ans_obj = await asyncio.to_thread(
+        atp_rag_query,
         question=question,
         chroma_dir=chroma_dir,
         embed_model=embed_model,
@@ -240,8 +391,13 @@ def main():
         choices=["streamable-http", "stdio"],
         help="Transport cho MCP server",
     )
+    parser.add_argument("--workers", type=int, default=1, help="Số worker process chạy job nền")
+    parser.add_argument("--jobs-db", default=str(DEFAULT_JOBS_DB), help="SQLite job queue")
     args = parser.parse_args()
 
+    # ingest dài chạy ở process riêng => không chặn các tool truy vấn
+    start_workers(Path(args.jobs_db), n=args.workers)
+
     # streamable-http: khuyến nghị, dễ test bằng inspector :contentReference[oaicite:4]{index=4}
     # stdio: dùng để tích hợp Claude Desktop/IDE; nhớ KHÔNG print ra stdout :contentReference[oaicite:5]{index=5}
     mcp.run(transport=args.transport)
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import json
+import shutil
+import threading
+import time
+import uuid
+from numbers import Number
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from atp.rag.rag_core import DEFAULT_COLLECTION, read_index_meta
+from atp.rag.snapshot import iter_collection, open_collection
+
+COMPACT_FORMAT = "atp-compact"
+COMPACT_VERSION = 1
+DTYPES = ("float16", "int8")
+
+# số dòng mỗi block khi nhân ma trận, giới hạn bộ nhớ tạm (float32) khi quét
+SCAN_BLOCK_ROWS = 65536
+# int8: số ứng viên được chấm lại bằng float16 = top_k * RERANK_FACTOR
+RERANK_FACTOR = 8
+
+
+def _write_strings(out_dir: Path, name: str, strings: List[str]):
+    """Chuỗi nối liền (utf-8) + offsets => mmap được, không cần parse JSON lúc mở."""
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    with open(out_dir / f"{name}.bin", "wb") as f:
+        pos = 0
+        for i, s in enumerate(strings):
+            b = (s or "").encode("utf-8")
+            f.write(b)
+            pos += len(b)
+            offsets[i + 1] = pos
+    np.save(out_dir / f"{name}.offsets.npy", offsets)
+
+
+def build_compact_index(
+    chroma_dir: Path,
+    out_dir: Path,
+    dtype: str = "float16",
+    collection: str = DEFAULT_COLLECTION,
+    embed_model: Optional[str] = None,
+) -> dict:
+    """
+    Build index gọn từ 1 thư mục Chroma có sẵn.
+
+    Layout out_dir:
+      manifest.json
+      vectors.f16.npy              - float16 [count, dim] (dùng cho exact search / re-rank)
+      vectors.i8.npy, scales.npy   - (dtype=int8) int8 lượng tử hoá theo dòng + scale
+      sqnorms.npy                  - |v|^2 (float32)
+      ids.bin/.offsets.npy, texts.bin/.offsets.npy
+      columns.json + col_<i>.npy   - metadata dạng cột, mã hoá từ điển (int32, -1 = thiếu)
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype phải là một trong {DTYPES}")
+
+    meta = read_index_meta(chroma_dir)
+    embed_model = embed_model or meta.get("embed_model")
+
+    col = open_collection(chroma_dir, collection)
+    space = (col.metadata or {}).get("hnsw:space", "l2")
+
+    ids: List[str] = []
+    texts: List[str] = []
+    metadatas: List[dict] = []
+    blocks: List[np.ndarray] = []
+    for page_ids, docs, metas, emb in iter_collection(col):
+        ids.extend(page_ids)
+        texts.extend(docs)
+        metadatas.extend(m or {} for m in metas)
+        blocks.append(emb)
+    vectors = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+    count, dim = vectors.shape
+
+    out_dir = Path(out_dir)
+    tmp = out_dir.with_name(f".{out_dir.name}.{uuid.uuid4().hex[:8]}.tmp")
+    tmp.mkdir(parents=True)
+
+    v16 = vectors.astype(np.float16)
+    np.save(tmp / "vectors.f16.npy", v16)
+    np.save(tmp / "sqnorms.npy", np.einsum("ij,ij->i", v16, v16, dtype=np.float32))
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        np.save(tmp / "vectors.i8.npy", np.round(vectors / scales[:, None]).astype(np.int8))
+        np.save(tmp / "scales.npy", scales.astype(np.float32))
+
+    _write_strings(tmp, "ids", ids)
+    _write_strings(tmp, "texts", texts)
+
+    names = sorted({k for m in metadatas for k in m})
+    columns = []
+    for ci, name in enumerate(names):
+        values: List = []
+        lookup: Dict = {}
+        codes = np.full(count, -1, dtype=np.int32)
+        for row, m in enumerate(metadatas):
+            if name not in m:
+                continue
+            v = m[name]
+            key = (type(v).__name__, v)
+            if key not in lookup:
+                lookup[key] = len(values)
+                values.append(v)
+            codes[row] = lookup[key]
+        np.save(tmp / f"col_{ci}.npy", codes)
+        columns.append({"name": name, "values": values})
+    (tmp / "columns.json").write_text(json.dumps(columns, ensure_ascii=False), encoding="utf-8")
+
+    manifest = {
+        "format": COMPACT_FORMAT,
+        "version": COMPACT_VERSION,
+        "created_at": time.time(),
+        "dtype": dtype,
+        "count": count,
+        "dimension": dim,
+        "space": space,
+        "embed_model": embed_model,
+        "built_from": str(chroma_dir),
+        "collection": collection,
+    }
+    (tmp / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    # thay thế atomic: process đang mmap bản cũ vẫn đọc được tới khi mở lại
+    if out_dir.exists():
+        old = out_dir.with_name(f".{out_dir.name}.{uuid.uuid4().hex[:8]}.old")
+        out_dir.rename(old)
+        tmp.rename(out_dir)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        tmp.rename(out_dir)
+    return manifest
+
+
+def _as_predicate(cond) -> Callable[[object], bool]:
+    if not isinstance(cond, dict):
+        return lambda v: v == cond
+
+    preds = []
+    for op, arg in cond.items():
+        if op == "$eq":
+            preds.append(lambda v, a=arg: v == a)
+        elif op == "$ne":
+            preds.append(lambda v, a=arg: v != a)
+        elif op == "$in":
+            preds.append(lambda v, a=arg: v in a)
+        elif op == "$nin":
+            preds.append(lambda v, a=arg: v not in a)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            cmp = {
+                "$gt": lambda v, a: v > a,
+                "$gte": lambda v, a: v >= a,
+                "$lt": lambda v, a: v < a,
+                "$lte": lambda v, a: v <= a,
+            }[op]
+            preds.append(
+                lambda v, a=arg, c=cmp: isinstance(v, Number) and not isinstance(v, bool) and c(v, a)
+            )
+        else:
+            raise ValueError(f"Không hỗ trợ operator: {op}")
+    return lambda v: all(p(v) for p in preds)
+
+
+class CompactIndex:
+    """Index chỉ đọc, mmap => nhiều process dùng chung page cache của OS."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.manifest = json.loads((self.path / "manifest.json").read_text(encoding="utf-8"))
+        if self.manifest.get("format") != COMPACT_FORMAT:
+            raise ValueError(f"{path} không phải compact index")
+
+        self.count = self.manifest["count"]
+        self.dim = self.manifest["dimension"]
+        self.space = self.manifest.get("space", "l2")
+        self.v16 = np.load(self.path / "vectors.f16.npy", mmap_mode="r")
+        self.sqnorms = np.load(self.path / "sqnorms.npy", mmap_mode="r")
+        self.i8 = None
+        if self.manifest["dtype"] == "int8":
+            self.i8 = np.load(self.path / "vectors.i8.npy", mmap_mode="r")
+            self.scales = np.load(self.path / "scales.npy", mmap_mode="r")
+
+        self._ids = self._open_strings("ids")
+        self._texts = self._open_strings("texts")
+        columns = json.loads((self.path / "columns.json").read_text(encoding="utf-8"))
+        self.columns = {
+            c["name"]: (c["values"], np.load(self.path / f"col_{i}.npy", mmap_mode="r"))
+            for i, c in enumerate(columns)
+        }
+
+    def _open_strings(self, name: str):
+        offsets = np.load(self.path / f"{name}.offsets.npy", mmap_mode="r")
+        data = np.memmap(self.path / f"{name}.bin", dtype=np.uint8, mode="r") if offsets[-1] else None
+        return offsets, data
+
+    @staticmethod
+    def _string_at(store, row: int) -> str:
+        offsets, data = store
+        a, b = int(offsets[row]), int(offsets[row + 1])
+        return bytes(data[a:b]).decode("utf-8") if data is not None else ""
+
+    # ---------- filter ----------
+
+    def where_mask(self, where: Optional[dict]) -> Optional[np.ndarray]:
+        """Filter kiểu Chroma ($and/$or/$eq/$ne/$in/$nin/$gt/...) -> mask bool theo dòng."""
+        if not where:
+            return None
+        masks = []
+        for key, cond in where.items():
+            if key == "$and":
+                masks.append(np.logical_and.reduce([self.where_mask(w) for w in cond]))
+            elif key == "$or":
+                masks.append(np.logical_or.reduce([self.where_mask(w) for w in cond]))
+            elif key in self.columns:
+                values, codes = self.columns[key]
+                pred = _as_predicate(cond)
+                matching = [i for i, v in enumerate(values) if pred(v)]
+                masks.append(np.isin(codes, matching))
+            else:
+                masks.append(np.zeros(self.count, dtype=bool))
+        return np.logical_and.reduce(masks)
+
+    # ---------- search ----------
+
+    def _distances(self, rows: np.ndarray, dots: np.ndarray, q: np.ndarray) -> np.ndarray:
+        # cùng quy ước khoảng cách với Chroma (l2 = bình phương khoảng cách)
+        if self.space == "cosine":
+            norms = np.sqrt(self.sqnorms[rows]) * np.linalg.norm(q)
+            return 1.0 - dots / np.maximum(norms, 1e-12)
+        if self.space == "ip":
+            return 1.0 - dots
+        return self.sqnorms[rows] - 2.0 * dots + float(q @ q)
+
+    def _scan(self, matrix, rows: Optional[np.ndarray], q: np.ndarray, scales=None) -> np.ndarray:
+        n = self.count if rows is None else len(rows)
+        out = np.empty(n, dtype=np.float32)
+        for a in range(0, n, SCAN_BLOCK_ROWS):
+            sel = slice(a, a + SCAN_BLOCK_ROWS) if rows is None else rows[a : a + SCAN_BLOCK_ROWS]
+            block = np.asarray(matrix[sel], dtype=np.float32)
+            dots = block @ q
+            if scales is not None:
+                dots *= scales[sel]
+            out[a : a + len(dots)] = dots
+        return out
+
+    def search(
+        self,
+        query_vec,
+        k: int = 4,
+        where: Optional[dict] = None,
+    ) -> List[Tuple[int, float]]:
+        q = np.asarray(query_vec, dtype=np.float32)
+        if q.shape != (self.dim,):
+            raise ValueError(f"Query dimension {q.shape[0]} khác index ({self.dim})")
+
+        mask = self.where_mask(where)
+        rows = None if mask is None else np.flatnonzero(mask)
+        all_rows = np.arange(self.count) if rows is None else rows
+        if len(all_rows) == 0:
+            return []
+
+        if self.i8 is None:
+            dist = self._distances(all_rows, self._scan(self.v16, rows, q), q)
+            cand = all_rows
+        else:
+            # lượt thô trên int8, sau đó chấm lại chính xác các ứng viên bằng float16
+            approx = self._distances(all_rows, self._scan(self.i8, rows, q, self.scales), q)
+            n_cand = min(len(approx), k * RERANK_FACTOR)
+            top = np.argpartition(approx, n_cand - 1)[:n_cand]
+            cand = np.sort(all_rows[top])
+            dist = self._distances(cand, np.asarray(self.v16[cand], dtype=np.float32) @ q, q)
+
+        k = min(k, len(dist))
+        top = np.argpartition(dist, k - 1)[:k]
+        top = top[np.argsort(dist[top], kind="stable")]
+        return [(int(cand[i]), float(dist[i])) for i in top]
+
+    def record(self, row: int) -> Tuple[str, str, dict]:
+        metadata = {}
+        for name, (values, codes) in self.columns.items():
+            c = int(codes[row])
+            if c >= 0:
+                metadata[name] = values[c]
+        return self._string_at(self._ids, row), self._string_at(self._texts, row), metadata
+
+
+_OPEN: Dict[str, Tuple[float, CompactIndex]] = {}
+_OPEN_LOCK = threading.Lock()
+
+
+def open_compact_index(path: Path) -> CompactIndex:
+    """Cache theo process; tự mở lại khi index được build lại (manifest đổi mtime)."""
+    key = str(Path(path).resolve())
+    mtime = (Path(path) / "manifest.json").stat().st_mtime
+    with _OPEN_LOCK:
+        cached = _OPEN.get(key)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, CompactIndex(Path(path)))
+            _OPEN[key] = cached
+        return cached[1]
@@ -1,19 +1,85 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Callable, Dict, Iterable, List, Optional
 
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_core.documents import Document
 from langchain_ollama import OllamaEmbeddings, OllamaLLM
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 
+# tham số mặc định; dùng `atp rag-sweep` để đo trade-off chất lượng/chi phí trước khi đổi
+DEFAULT_CHUNK_SIZE = 1500
+DEFAULT_CHUNK_OVERLAP = 200
+DEFAULT_TOP_K = 4
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_COLLECTION = "langchain"  # tên collection mặc định của langchain_chroma
+
+# "chroma": persist_dir là thư mục Chroma
+# "compact": persist_dir là compact index (xem atp.rag.compact, build bằng `atp compact-build`)
+BACKENDS = ("chroma", "compact")
+
+# sidecar trong persist_dir: embed model + tham số chunking đã dùng để build index
+INDEX_META_FILE = "atp_index.json"
+
+# progress(chunks_done, chunks_total) - gọi sau mỗi batch đã ghi xong vào Chroma
+ProgressFn = Callable[[int, int], None]
+
+
 @dataclass
 class RetrievedHit:
     page_content: str
     metadata: dict
+    # khoảng cách tới câu hỏi theo space của index (nhỏ hơn = gần hơn) + chunk id trong index
+    score: Optional[float] = None
+    id: Optional[str] = None
+
+    def source(self, preview_chars: int = 400) -> dict:
+        return {
+            "id": self.id,
+            "score": self.score,
+            "metadata": self.metadata,
+            "preview": self.page_content[:preview_chars],
+        }
+
+
+@dataclass
+class QueryResult:
+    """
+    Kết quả 1 lần hỏi: answer + hits dùng làm ngữ cảnh (1 lượt retrieval duy nhất).
+    prompt_tokens/completion_tokens: số Ollama trả về; nếu không có thì ước lượng (tokens_estimated=True).
+    timings: embed_s, search_s, generate_s, total_s.
+    """
+
+    question: str
+    answer: str
+    hits: List[RetrievedHit]
+    prompt_tokens: int
+    completion_tokens: int
+    tokens_estimated: bool
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    def sources(self, preview_chars: int = 400) -> List[dict]:
+        return [h.source(preview_chars) for h in self.hits]
+
+    def to_dict(self, preview_chars: int = 400) -> dict:
+        return {
+            "question": self.question,
+            "answer": self.answer,
+            "sources": self.sources(preview_chars),
+            "tokens": {
+                "prompt": self.prompt_tokens,
+                "completion": self.completion_tokens,
+                "estimated": self.tokens_estimated,
+            },
+            "timings": {k: round(v, 4) for k, v in self.timings.items()},
+        }
 
 
 def load_pdfs(pdf_paths: Iterable[Path]):
@@ -36,39 +102,123 @@ def extract_pdfs_text(pdf_paths: Iterable[Path]) -> str:
     return "\n".join(parts).strip()
 
 
-def _make_splitter(chunk_size: int, chunk_overlap: int):
+def make_splitter(chunk_size: int, chunk_overlap: int):
     return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
     )
 
 
-def build_vectorstore_from_pdfs(
-    pdf_paths: List[Path],
+def split_pdfs(
+    pdf_paths: Iterable[Path],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> List[Document]:
+    splitter = make_splitter(chunk_size, chunk_overlap)
+    return splitter.split_documents(load_pdfs(pdf_paths))
+
+
+def _chunk_ids(chunks: List[Document]) -> List[str]:
+    """
+    ID tất định theo (source, page, thứ tự trong page, nội dung).
+    Chạy lại cùng dữ liệu => upsert đè lên chunk cũ thay vì nhân bản,
+    nên có thể resume ingest giữa chừng mà không lo trùng.
+    """
+    seen: dict = {}
+    ids = []
+    for c in chunks:
+        key = (str(c.metadata.get("source", "")), str(c.metadata.get("page", "")))
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        raw = "\x1f".join([key[0], key[1], str(n), c.page_content])
+        ids.append(hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32])
+    return ids
+
+
+def read_index_meta(persist_dir: Path) -> dict:
+    p = Path(persist_dir) / INDEX_META_FILE
+    if not p.exists():
+        return {}
+    return json.loads(p.read_text(encoding="utf-8"))
+
+
+def write_index_meta(persist_dir: Path, embed_model: str, chunking: Optional[dict] = None):
+    """
+    Ghi embed model (+ chunking) của index. Không cho trộn vector của 2 embed model
+    khác nhau trong cùng 1 persist_dir => raise ValueError.
+    """
+    meta = read_index_meta(persist_dir)
+    if meta.get("embed_model") and meta["embed_model"] != embed_model:
+        raise ValueError(
+            f"{persist_dir} đã được build bằng embed model '{meta['embed_model']}', "
+            f"không thể ghi thêm bằng '{embed_model}'"
+        )
+    meta["embed_model"] = embed_model
+    if chunking:
+        meta.setdefault("chunking", chunking)
+    Path(persist_dir).mkdir(parents=True, exist_ok=True)
+    (Path(persist_dir) / INDEX_META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+
+def add_chunks_to_vectorstore(
+    chunks: List[Document],
     persist_dir: Path,
     embed_model: str = "embeddinggemma",
-    chunk_size: int = 1500,
-    chunk_overlap: int = 200,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    start: int = 0,
+    progress: Optional[ProgressFn] = None,
+    chunking: Optional[dict] = None,
 ) -> int:
-    raw_docs = load_pdfs(pdf_paths)
-    splitter = _make_splitter(chunk_size, chunk_overlap)
-    chunks = splitter.split_documents(raw_docs)
-
+    """
+    Embed + ghi chunks theo từng batch.
+    start: bỏ qua các chunk đã ghi ở lần chạy trước (resume).
+    chunking: {"chunk_size", "chunk_overlap"} đã dùng, lưu vào sidecar của index.
+    """
+    write_index_meta(persist_dir, embed_model, chunking)
+    ids = _chunk_ids(chunks)
     emb = OllamaEmbeddings(model=embed_model)
-    Chroma.from_documents(
-        documents=chunks,
-        embedding=emb,
+    db = Chroma(
+        collection_name=DEFAULT_COLLECTION,
         persist_directory=str(persist_dir),
+        embedding_function=emb,
+    )
+
+    total = len(chunks)
+    for i in range(start, total, batch_size):
+        db.add_documents(chunks[i : i + batch_size], ids=ids[i : i + batch_size])
+        if progress is not None:
+            progress(min(i + batch_size, total), total)
+    return total
+
+
+def build_vectorstore_from_pdfs(
+    pdf_paths: List[Path],
+    persist_dir: Path,
+    embed_model: str = "embeddinggemma",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    start: int = 0,
+    progress: Optional[ProgressFn] = None,
+) -> int:
+    chunks = split_pdfs(pdf_paths, chunk_size, chunk_overlap)
+    return add_chunks_to_vectorstore(
+        chunks,
+        persist_dir,
+        embed_model=embed_model,
+        batch_size=batch_size,
+        start=start,
+        progress=progress,
+        chunking={"chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
     )
-    return len(chunks)
 
 
 def add_textfile_to_vectorstore(
     text_path: Path,
     persist_dir: Path,
     embed_model: str = "embeddinggemma",
-    chunk_size: int = 1500,
-    chunk_overlap: int = 200,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
     metadata: Optional[dict] = None,
 ) -> int:
     loader = TextLoader(str(text_path), encoding="utf-8")
@@ -77,63 +227,202 @@ def add_textfile_to_vectorstore(
         for d in docs:
             d.metadata.update(metadata)
 
-    splitter = _make_splitter(chunk_size, chunk_overlap)
+    splitter = make_splitter(chunk_size, chunk_overlap)
     chunks = splitter.split_documents(docs)
+    return add_chunks_to_vectorstore(
+        chunks,
+        persist_dir,
+        embed_model=embed_model,
+        chunking={"chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
+    )
 
-    emb = OllamaEmbeddings(model=embed_model)
-    db = Chroma(persist_directory=str(persist_dir), embedding_function=emb)
-    db.add_documents(chunks)
-    return len(chunks)
+
+def split_text(
+    text: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    metadata: Optional[dict] = None,
+) -> List[Document]:
+    meta = dict(metadata or {})
+    meta.setdefault("source", meta.get("url", ""))
+    splitter = make_splitter(chunk_size, chunk_overlap)
+    return splitter.split_documents([Document(page_content=text, metadata=meta)])
+
+
+def add_text_to_vectorstore(
+    text: str,
+    persist_dir: Path,
+    embed_model: str = "embeddinggemma",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    metadata: Optional[dict] = None,
+) -> int:
+    """Giống add_textfile_to_vectorstore nhưng nhận text trực tiếp (vd: từ artifact store)."""
+    chunks = split_text(text, chunk_size, chunk_overlap, metadata=metadata)
+    return add_chunks_to_vectorstore(
+        chunks,
+        persist_dir,
+        embed_model=embed_model,
+        chunking={"chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
+    )
 
 
 def retrieve_hits(
     question: str,
     persist_dir: Path,
     embed_model: str = "embeddinggemma",
-    top_k: int = 4,
+    top_k: int = DEFAULT_TOP_K,
     where: Optional[dict] = None,
+    backend: str = "chroma",
+    timings: Optional[Dict[str, float]] = None,
 ) -> List[RetrievedHit]:
     """
     where: filter theo metadata.
 
     Ví dụ lọc đúng 1 URL (Chroma yêu cầu 1 operator):
       where={"$and": [{"source_type": "web"}, {"url": "https://..."}]}
+
+    timings: nếu truyền dict => ghi thêm embed_s / search_s.
     """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend phải là một trong {BACKENDS}")
+    timings = {} if timings is None else timings
+    if backend == "compact":
+        return _retrieve_hits_compact(question, persist_dir, embed_model, top_k, where, timings)
+
     emb = OllamaEmbeddings(model=embed_model)
-    db = Chroma(persist_directory=str(persist_dir), embedding_function=emb)
+    t0 = time.perf_counter()
+    qvec = emb.embed_query(question)
+    timings["embed_s"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    db = Chroma(
+        collection_name=DEFAULT_COLLECTION,
+        persist_directory=str(persist_dir),
+        embedding_function=emb,
+    )
 
     # Tương thích nhiều phiên bản: ưu tiên filter=..., fallback where=...
     try:
-        docs = db.similarity_search(question, k=top_k, filter=where)
+        pairs = db.similarity_search_by_vector_with_relevance_scores(qvec, k=top_k, filter=where)
     except TypeError:
-        docs = db.similarity_search(question, k=top_k, where=where)
+        pairs = db.similarity_search_by_vector_with_relevance_scores(qvec, k=top_k, where=where)
+    timings["search_s"] = time.perf_counter() - t0
 
-    return [RetrievedHit(page_content=d.page_content, metadata=d.metadata) for d in docs]
+    return [
+        RetrievedHit(
+            page_content=d.page_content,
+            metadata=d.metadata,
+            score=float(dist),
+            id=getattr(d, "id", None),
+        )
+        for d, dist in pairs
+    ]
 
 
-def answer_query(
+def _retrieve_hits_compact(
+    question: str,
+    index_dir: Path,
+    embed_model: str,
+    top_k: int,
+    where: Optional[dict],
+    timings: Dict[str, float],
+) -> List[RetrievedHit]:
+    from atp.rag.compact import open_compact_index
+
+    index = open_compact_index(index_dir)
+    built_with = index.manifest.get("embed_model")
+    if built_with and built_with != embed_model:
+        raise ValueError(f"{index_dir} được build bằng embed model '{built_with}', không phải '{embed_model}'")
+
+    t0 = time.perf_counter()
+    qvec = OllamaEmbeddings(model=embed_model).embed_query(question)
+    timings["embed_s"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    hits = []
+    for row, dist in index.search(qvec, k=top_k, where=where):
+        chunk_id, text, metadata = index.record(row)
+        hits.append(RetrievedHit(page_content=text, metadata=metadata, score=dist, id=chunk_id))
+    timings["search_s"] = time.perf_counter() - t0
+    return hits
+
+
+def build_prompt(question: str, hits: List[RetrievedHit]) -> str:
+    context = "\n\n---\n\n".join([h.page_content for h in hits])
+    return f"""Bạn chỉ trả lời dựa trên NGỮ CẢNH. Nếu NGỮ CẢNH không chứa thông tin cần thiết, hãy trả lời đúng một câu: "không đủ thông tin".
+
+NGỮ CẢNH:
+{context}
+
+CÂU HỎI: {question}
+TRẢ LỜI:"""
+
+
+def estimate_tokens(text: str) -> int:
+    # ước lượng thô ~4 ký tự/token (không phụ thuộc tokenizer của model)
+    return (len(text) + 3) // 4
+
+
+def run_query(
     question: str,
     persist_dir: Path,
     embed_model: str = "embeddinggemma",
     chat_model: str = "qwen3:1.7b",
-    top_k: int = 4,
+    top_k: int = DEFAULT_TOP_K,
     where: Optional[dict] = None,
-) -> str:
+    backend: str = "chroma",
+) -> QueryResult:
+    """Retrieval 1 lần + generate; trả về answer kèm nguồn, số token và thời gian từng bước."""
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
     hits = retrieve_hits(
         question=question,
         persist_dir=persist_dir,
         embed_model=embed_model,
         top_k=top_k,
         where=where,
+        backend=backend,
+        timings=timings,
     )
-    context = "\n\n---\n\n".join([h.page_content for h in hits])
+    prompt = build_prompt(question, hits)
 
     llm = OllamaLLM(model=chat_model)
-    prompt = f"""Bạn chỉ trả lời dựa trên NGỮ CẢNH. Nếu NGỮ CẢNH không chứa thông tin cần thiết, hãy trả lời đúng một câu: "không đủ thông tin".
+    t0 = time.perf_counter()
+    gen = llm.generate([prompt]).generations[0][0]
+    timings["generate_s"] = time.perf_counter() - t0
+    timings["total_s"] = time.perf_counter() - started
 
-NGỮ CẢNH:
-{context}
+    info = gen.generation_info or {}
+    prompt_tokens = info.get("prompt_eval_count")
+    completion_tokens = info.get("eval_count")
+    estimated = prompt_tokens is None or completion_tokens is None
+    return QueryResult(
+        question=question,
+        answer=gen.text,
+        hits=hits,
+        prompt_tokens=estimate_tokens(prompt) if prompt_tokens is None else int(prompt_tokens),
+        completion_tokens=estimate_tokens(gen.text) if completion_tokens is None else int(completion_tokens),
+        tokens_estimated=estimated,
+        timings=timings,
+    )
 
-CÂU HỎI: {question}
-TRẢ LỜI:"""
-    return llm.invoke(prompt)
+
+def answer_query(
+    question: str,
+    persist_dir: Path,
+    embed_model: str = "embeddinggemma",
+    chat_model: str = "qwen3:1.7b",
+    top_k: int = DEFAULT_TOP_K,
+    where: Optional[dict] = None,
+    backend: str = "chroma",
+) -> str:
+    return run_query(
+        question=question,
+        persist_dir=persist_dir,
+        embed_model=embed_model,
+        chat_model=chat_model,
+        top_k=top_k,
+        where=where,
+        backend=backend,
+    ).answer
@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import chromadb
+import numpy as np
+import zstandard
+
+from atp.rag.rag_core import DEFAULT_COLLECTION, read_index_meta, write_index_meta
+
+SNAPSHOT_FORMAT = "atp-kb-snapshot"
+SNAPSHOT_VERSION = 1
+
+MANIFEST = "manifest.json"
+CHUNKS = "chunks.jsonl"
+VECTORS = "vectors.npy"
+_MEMBERS = (CHUNKS, VECTORS)
+
+PAGE_SIZE = 1000
+COPY_BUFSIZE = 1 << 20
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_BUFSIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def open_collection(chroma_dir: Path, collection: str = DEFAULT_COLLECTION):
+    client = chromadb.PersistentClient(path=str(chroma_dir))
+    return client.get_collection(collection)
+
+
+def iter_collection(col, page_size: int = PAGE_SIZE) -> Iterator[Tuple[list, list, list, np.ndarray]]:
+    """Đọc toàn bộ collection theo trang: (ids, documents, metadatas, embeddings float32)."""
+    for offset in range(0, col.count(), page_size):
+        page = col.get(
+            limit=page_size,
+            offset=offset,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        emb = np.asarray(page["embeddings"], dtype=np.float32)
+        yield page["ids"], page["documents"], page["metadatas"], emb
+
+
+def export_snapshot(
+    chroma_dir: Path,
+    out_path: Path,
+    collection: str = DEFAULT_COLLECTION,
+    embed_model: Optional[str] = None,
+    level: int = 10,
+) -> dict:
+    """
+    Đóng gói 1 collection Chroma thành 1 file .atpkb (tar nén zstd):
+      manifest.json  - version, embed model, dimension, chunking, sha256 từng member
+      chunks.jsonl   - {"id", "document", "metadata"} theo đúng thứ tự dòng của vectors
+      vectors.npy    - float32 [count, dim]
+
+    embed_model: mặc định lấy từ sidecar của index (atp_index.json).
+    """
+    meta = read_index_meta(chroma_dir)
+    embed_model = embed_model or meta.get("embed_model")
+    if not embed_model:
+        raise ValueError(
+            f"Không biết embed model của {chroma_dir} (thiếu sidecar) - hãy truyền embed_model"
+        )
+    if meta.get("embed_model") and meta["embed_model"] != embed_model:
+        raise ValueError(f"{chroma_dir} được build bằng '{meta['embed_model']}', không phải '{embed_model}'")
+
+    col = open_collection(chroma_dir, collection)
+    count = col.count()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        vectors = None
+        dim = 0
+        offset = 0
+        with open(tmp / CHUNKS, "w", encoding="utf-8") as chunks_f:
+            for ids, documents, metadatas, emb in iter_collection(col):
+                if vectors is None:
+                    dim = emb.shape[1]
+                    vectors = np.lib.format.open_memmap(
+                        tmp / VECTORS, mode="w+", dtype=np.float32, shape=(count, dim)
+                    )
+                vectors[offset : offset + len(emb)] = emb
+                offset += len(emb)
+                for i, doc, md in zip(ids, documents, metadatas):
+                    chunks_f.write(
+                        json.dumps({"id": i, "document": doc, "metadata": md}, ensure_ascii=False) + "\n"
+                    )
+        if vectors is None:
+            np.save(tmp / VECTORS, np.zeros((0, 0), dtype=np.float32))
+        else:
+            vectors.flush()
+            del vectors
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created_at": time.time(),
+            "collection": collection,
+            "collection_metadata": col.metadata or None,
+            "count": count,
+            "embed_model": embed_model,
+            "dimension": dim,
+            "chunking": meta.get("chunking"),
+            "members": {
+                name: {"sha256": _sha256_file(tmp / name), "bytes": (tmp / name).stat().st_size}
+                for name in _MEMBERS
+            },
+        }
+        (tmp / MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        out_path = Path(out_path)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        cctx = zstandard.ZstdCompressor(level=level, write_checksum=True, threads=-1)
+        with open(out_path, "wb") as fh, cctx.stream_writer(fh) as zw:
+            with tarfile.open(fileobj=zw, mode="w|") as tar:
+                # manifest đứng đầu => lúc import kiểm tra tương thích trước khi đọc dữ liệu
+                for name in (MANIFEST, CHUNKS, VECTORS):
+                    tar.add(tmp / name, arcname=name)
+
+    manifest["bundle_bytes"] = out_path.stat().st_size
+    return manifest
+
+
+def _check_compatible(manifest: dict, chroma_dir: Path, embed_model: str, collection: str):
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError("File không phải snapshot ATP")
+    if manifest.get("version", 0) > SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {manifest['version']} mới hơn bản hỗ trợ ({SNAPSHOT_VERSION})")
+    if manifest["embed_model"] != embed_model:
+        raise ValueError(
+            f"Snapshot dùng embed model '{manifest['embed_model']}', node này dùng '{embed_model}'"
+        )
+
+    target_meta = read_index_meta(chroma_dir)
+    if target_meta.get("embed_model") and target_meta["embed_model"] != embed_model:
+        raise ValueError(f"{chroma_dir} đã có dữ liệu của embed model '{target_meta['embed_model']}'")
+
+    if not (chroma_dir / "chroma.sqlite3").exists():
+        return
+    client = chromadb.PersistentClient(path=str(chroma_dir))
+    try:
+        existing = client.get_collection(collection)
+    except Exception:
+        return
+    peek = existing.get(limit=1, include=["embeddings"])
+    if peek["ids"] and len(peek["embeddings"][0]) != manifest["dimension"]:
+        raise ValueError(
+            f"Dimension không khớp: collection hiện có {len(peek['embeddings'][0])}, "
+            f"snapshot {manifest['dimension']}"
+        )
+
+
+def import_snapshot(
+    bundle_path: Path,
+    chroma_dir: Path,
+    embed_model: str,
+    collection: Optional[str] = None,
+) -> dict:
+    """
+    Nạp snapshot vào chroma_dir (upsert theo id) mà không gọi embedder.
+    Từ chối nếu embed model / dimension không khớp hoặc checksum sai.
+    """
+    chroma_dir = Path(chroma_dir)
+    dctx = zstandard.ZstdDecompressor()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        manifest = None
+        with open(bundle_path, "rb") as fh, dctx.stream_reader(fh) as zr:
+            with tarfile.open(fileobj=zr, mode="r|") as tar:
+                for member in tar:
+                    if manifest is None:
+                        if member.name != MANIFEST:
+                            raise ValueError("Snapshot hỏng: thiếu manifest ở đầu")
+                        manifest = json.loads(tar.extractfile(member).read().decode("utf-8"))
+                        collection = collection or manifest["collection"]
+                        _check_compatible(manifest, chroma_dir, embed_model, collection)
+                        if set(manifest.get("members") or ()) != set(_MEMBERS):
+                            raise ValueError("Snapshot hỏng: danh sách member không hợp lệ")
+                        continue
+                    # chỉ nhận đúng tên cố định => tên kiểu "../x" không ghi được ra ngoài thư mục tạm
+                    if member.name not in _MEMBERS or not member.isfile():
+                        raise ValueError(f"Snapshot hỏng: member lạ '{member.name}'")
+                    src = tar.extractfile(member)
+                    with open(tmp / member.name, "wb") as dst:
+                        shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+
+        if manifest is None:
+            raise ValueError("Snapshot rỗng")
+        for name in _MEMBERS:
+            path = tmp / name
+            if not path.exists() or _sha256_file(path) != manifest["members"][name]["sha256"]:
+                raise ValueError(f"Checksum sai: {name}")
+
+        chroma_dir.mkdir(parents=True, exist_ok=True)
+        client = chromadb.PersistentClient(path=str(chroma_dir))
+        col = client.get_or_create_collection(collection, metadata=manifest.get("collection_metadata"))
+        batch = client.get_max_batch_size()
+
+        vectors = np.load(tmp / VECTORS, mmap_mode="r")
+        loaded = 0
+        with open(tmp / CHUNKS, encoding="utf-8") as chunks_f:
+            ids, docs, metas = [], [], []
+
+            def _flush():
+                nonlocal loaded
+                if not ids:
+                    return
+                col.upsert(
+                    ids=ids,
+                    documents=docs,
+                    metadatas=metas,
+                    embeddings=np.asarray(vectors[loaded : loaded + len(ids)]),
+                )
+                loaded += len(ids)
+                ids.clear()
+                docs.clear()
+                metas.clear()
+
+            for line in chunks_f:
+                row = json.loads(line)
+                ids.append(row["id"])
+                docs.append(row["document"])
+                metas.append(row["metadata"])
+                if len(ids) >= batch:
+                    _flush()
+            _flush()
+
+    write_index_meta(chroma_dir, embed_model, manifest.get("chunking"))
+    return {
+        "collection": collection,
+        "loaded": loaded,
+        "embed_model": embed_model,
+        "dimension": manifest["dimension"],
+        "chroma_dir": str(chroma_dir),
+    }
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import chromadb
+import numpy as np
+from langchain_community.document_loaders import TextLoader
+from langchain_core.documents import Document
+from langchain_ollama import OllamaEmbeddings
+
+from atp.rag.rag_core import (
+    DEFAULT_BATCH_SIZE,
+    RetrievedHit,
+    build_prompt,
+    estimate_tokens,
+    load_pdfs,
+    make_splitter,
+)
+
+DEFAULT_EMBED_CACHE = Path("data/embed_cache.sqlite3")
+TEXT_SUFFIXES = (".txt", ".md")
+
+
+@dataclass
+class SweepRow:
+    chunk_size: int
+    chunk_overlap: int
+    top_k: int
+    chunks: int
+    embed_s: float
+    index_bytes: int
+    recall: float
+    mrr: float
+    avg_prompt_tokens: float
+    questions: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class EmbeddingCache:
+    """
+    Cache embedding theo sha256(model + text) trên SQLite.
+    Lưu cả thời gian embed của từng text => vẫn báo được chi phí embed "cold"
+    cho các cấu hình dùng lại chunk đã cache.
+    """
+
+    def __init__(self, path: Path, embed_model: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.path = Path(path)
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self._emb = OllamaEmbeddings(model=embed_model)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as con, con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL, seconds REAL NOT NULL)"
+            )
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.embed_model}\x1f{kind}\x1f{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, con, keys: List[str]) -> Dict[str, tuple]:
+        found = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i : i + 500]
+            rows = con.execute(
+                f"SELECT key, vec, seconds FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                part,
+            ).fetchall()
+            found.update({k: (np.frombuffer(v, dtype=np.float32), s) for k, v, s in rows})
+        return found
+
+    def embed(self, texts: Sequence[str], kind: str = "doc") -> tuple:
+        """Trả về (vectors [n, dim], tổng số giây embed nếu chạy cold)."""
+        keys = [self._key(kind, t) for t in texts]
+        with closing(sqlite3.connect(self.path)) as con:
+            found = self._lookup(con, keys)
+            missing = [i for i, k in enumerate(keys) if k not in found]
+            # dedupe: chunk trùng nội dung chỉ embed 1 lần
+            todo = list({keys[i]: texts[i] for i in missing}.items())
+            for b in range(0, len(todo), self.batch_size):
+                batch = todo[b : b + self.batch_size]
+                t0 = time.perf_counter()
+                if kind == "query":
+                    vecs = [self._emb.embed_query(t) for _, t in batch]
+                else:
+                    vecs = self._emb.embed_documents([t for _, t in batch])
+                per_item = (time.perf_counter() - t0) / len(batch)
+                rows = []
+                for (k, _), v in zip(batch, vecs):
+                    arr = np.asarray(v, dtype=np.float32)
+                    found[k] = (arr, per_item)
+                    rows.append((k, arr.shape[0], arr.tobytes(), per_item))
+                with con:
+                    con.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+
+        vectors = np.stack([found[k][0] for k in keys]) if keys else np.zeros((0, 0), np.float32)
+        seconds = sum(found[k][1] for k in set(keys))
+        return vectors, seconds
+
+
+def load_corpus(corpus_dir: Path) -> List[Document]:
+    """PDF (PyPDFLoader) + .txt/.md (TextLoader) trong corpus_dir (đệ quy)."""
+    paths = sorted(p for p in Path(corpus_dir).rglob("*") if p.is_file())
+    docs = load_pdfs([p for p in paths if p.suffix.lower() == ".pdf"])
+    for p in paths:
+        if p.suffix.lower() in TEXT_SUFFIXES:
+            docs.extend(TextLoader(str(p), encoding="utf-8").load())
+    return docs
+
+
+def load_questions(path: Path) -> List[dict]:
+    """
+    JSONL, mỗi dòng:
+      {"question": "...", "answers": ["đoạn text phải có trong chunk đúng", ...],
+       "sources": ["tailieu.pdf", ...]}   # tuỳ chọn
+    """
+    out = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        q = json.loads(line)
+        if not q.get("answers") and not q.get("sources"):
+            raise ValueError(f"Câu hỏi thiếu nhãn answers/sources: {q.get('question')}")
+        out.append(q)
+    if not out:
+        raise ValueError(f"Không có câu hỏi nào trong {path}")
+    return out
+
+
+def _norm(s: str) -> str:
+    return " ".join(s.split()).casefold()
+
+
+def is_relevant(text: str, metadata: dict, q: dict) -> bool:
+    """Chunk đúng nếu chứa 1 trong các answers; nếu câu hỏi chỉ gán sources thì so theo tên file nguồn."""
+    if q.get("answers"):
+        t = _norm(text)
+        return any(_norm(a) in t for a in q["answers"])
+    src = str(metadata.get("source", "")).replace("\\", "/")
+    return any(src == s or src.endswith("/" + s) for s in q["sources"])
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+
+def run_sweep(
+    corpus_dir: Path,
+    questions_path: Path,
+    chunk_sizes: Sequence[int],
+    chunk_overlaps: Sequence[int],
+    top_ks: Sequence[int],
+    embed_model: str = "embeddinggemma",
+    cache_path: Path = DEFAULT_EMBED_CACHE,
+    progress=None,
+) -> List[SweepRow]:
+    """
+    Với mỗi (chunk_size, chunk_overlap): chia corpus, embed (qua cache), build Chroma tạm,
+    truy vấn 1 lần với max(top_k) rồi tính metric cho từng top_k trên prefix kết quả.
+
+    recall: tỉ lệ câu hỏi có ít nhất 1 chunk đúng trong top_k
+    mrr: trung bình 1/rank của chunk đúng đầu tiên (0 nếu không có trong top_k)
+    embed_s: thời gian embed nếu chạy cold (lấy từ cache), index_bytes: dung lượng Chroma tạm
+    """
+    docs = load_corpus(corpus_dir)
+    if not docs:
+        raise ValueError(f"Không thấy tài liệu trong {corpus_dir}")
+    questions = load_questions(questions_path)
+    cache = EmbeddingCache(cache_path, embed_model)
+    qvecs, _ = cache.embed([q["question"] for q in questions], kind="query")
+    max_k = max(top_ks)
+
+    rows: List[SweepRow] = []
+    for size, overlap in itertools.product(chunk_sizes, chunk_overlaps):
+        if overlap >= size:
+            continue
+        chunks = make_splitter(size, overlap).split_documents(docs)
+        if not chunks:
+            # corpus chỉ có trang rỗng => không có gì để truy vấn
+            continue
+        vectors, embed_s = cache.embed([c.page_content for c in chunks])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            client = chromadb.PersistentClient(path=tmp)
+            col = client.create_collection("sweep")
+            step = client.get_max_batch_size()
+            for i in range(0, len(chunks), step):
+                col.add(
+                    ids=[str(j) for j in range(i, min(i + step, len(chunks)))],
+                    embeddings=vectors[i : i + step],
+                    documents=[c.page_content for c in chunks[i : i + step]],
+                )
+            index_bytes = _dir_bytes(Path(tmp))
+            res = col.query(query_embeddings=qvecs, n_results=min(max_k, len(chunks)), include=[])
+            # Chroma cache 1 system/path => phải giải phóng (sqlite + HNSW) trước khi xoá thư mục tạm
+            client.clear_system_cache()
+            del col, client
+
+        ranked = [[int(i) for i in ids] for ids in res["ids"]]
+        for k in top_ks:
+            hit_at, rr, tokens = 0, 0.0, 0
+            for q, ids in zip(questions, ranked):
+                top = [chunks[i] for i in ids[:k]]
+                rank = next(
+                    (r for r, c in enumerate(top, 1) if is_relevant(c.page_content, c.metadata, q)),
+                    None,
+                )
+                if rank is not None:
+                    hit_at += 1
+                    rr += 1.0 / rank
+                hits = [RetrievedHit(page_content=c.page_content, metadata=c.metadata) for c in top]
+                tokens += estimate_tokens(build_prompt(q["question"], hits))
+            n = len(questions)
+            row = SweepRow(
+                chunk_size=size,
+                chunk_overlap=overlap,
+                top_k=k,
+                chunks=len(chunks),
+                embed_s=round(embed_s, 2),
+                index_bytes=index_bytes,
+                recall=round(hit_at / n, 4),
+                mrr=round(rr / n, 4),
+                avg_prompt_tokens=round(tokens / n, 1),
+                questions=n,
+            )
+            rows.append(row)
+            if progress is not None:
+                progress(row)
+    return rows
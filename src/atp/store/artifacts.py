@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import zstandard
+
+DEFAULT_ZSTD_LEVEL = 10
+
+
+@dataclass
+class ArtifactRef:
+    """Handle trả về cho caller thay vì đường dẫn file cố định."""
+
+    digest: str
+    run_id: str
+    name: str
+    url: Optional[str]
+    size: int
+    stored_size: int
+    created_at: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def new_run_id() -> str:
+    # timestamp trước để sort được, phần random để các run song song không đụng nhau
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+
+class ArtifactStore:
+    """
+    Kho artifact địa chỉ hoá theo nội dung (sha256), nén zstd.
+
+    Layout:
+      <root>/blobs/ab/abcdef....zst   # nội dung (dedupe theo hash)
+      <root>/index.sqlite3            # run_id/url/name -> digest
+
+    Nhiều process có thể ghi song song: blob ghi atomic (tmp + rename),
+    index dùng SQLite WAL + BEGIN IMMEDIATE.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        level: int = DEFAULT_ZSTD_LEVEL,
+        max_bytes: Optional[int] = None,
+        max_age_days: Optional[float] = None,
+        max_runs: Optional[int] = None,
+    ):
+        self.root = Path(root)
+        self.level = level
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.max_runs = max_runs
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / "blobs").mkdir(exist_ok=True)
+        with closing(self._connect()) as con:
+            con.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    stored_size INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS refs (
+                    run_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    url TEXT,
+                    digest TEXT NOT NULL REFERENCES blobs(digest),
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (run_id, name)
+                );
+                CREATE INDEX IF NOT EXISTS refs_url ON refs(url);
+                CREATE INDEX IF NOT EXISTS refs_digest ON refs(digest);
+                """
+            )
+
+    # ---------- internal ----------
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.root / "index.sqlite3", timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / f"{digest}.zst"
+
+    def _compress_to_tmp(self, digest: str, data: bytes) -> Path:
+        path = self._blob_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{uuid.uuid4().hex[:6]}.tmp")
+        tmp.write_bytes(zstandard.ZstdCompressor(level=self.level).compress(data))
+        return tmp
+
+    def _row_to_ref(self, row) -> ArtifactRef:
+        run_id, name, url, digest, created_at, size, stored_size = row
+        return ArtifactRef(
+            digest=digest,
+            run_id=run_id,
+            name=name,
+            url=url,
+            size=size,
+            stored_size=stored_size,
+            created_at=created_at,
+        )
+
+    # ---------- write ----------
+
+    def put_bytes(
+        self,
+        data: bytes,
+        name: str,
+        run_id: Optional[str] = None,
+        url: Optional[str] = None,
+    ) -> ArtifactRef:
+        run_id = run_id or new_run_id()
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+
+        path = self._blob_path(digest)
+        # nén trước khi lấy lock ghi => các process ghi song song không phải chờ nhau nén
+        tmp = None if path.exists() else self._compress_to_tmp(digest, data)
+        con = self._connect()
+        try:
+            # trong lock chỉ còn kiểm tra + rename + INSERT; prune() không xoá được blob đang được tham chiếu lại
+            con.execute("BEGIN IMMEDIATE")
+            if not path.exists():
+                if tmp is None:
+                    # blob vừa bị prune() xoá sau lần kiểm tra ở trên (hiếm) => nén lại
+                    tmp = self._compress_to_tmp(digest, data)
+                os.replace(tmp, path)
+                tmp = None
+            stored_size = path.stat().st_size
+            con.execute(
+                "INSERT OR IGNORE INTO blobs(digest, size, stored_size, created_at) VALUES (?, ?, ?, ?)",
+                (digest, len(data), stored_size, now),
+            )
+            con.execute(
+                "INSERT OR REPLACE INTO refs(run_id, name, url, digest, created_at) VALUES (?, ?, ?, ?, ?)",
+                (run_id, name, url, digest, now),
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            # BEGIN IMMEDIATE hết timeout => chưa có transaction, giữ nguyên lỗi "database is locked"
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+            if tmp is not None:
+                # blob cùng nội dung đã có sẵn (process khác vừa ghi) hoặc lỗi => bỏ file tạm
+                tmp.unlink(missing_ok=True)
+
+        return ArtifactRef(
+            digest=digest,
+            run_id=run_id,
+            name=name,
+            url=url,
+            size=len(data),
+            stored_size=stored_size,
+            created_at=now,
+        )
+
+    def put_text(
+        self,
+        text: str,
+        name: str,
+        run_id: Optional[str] = None,
+        url: Optional[str] = None,
+    ) -> ArtifactRef:
+        return self.put_bytes(text.encode("utf-8"), name=name, run_id=run_id, url=url)
+
+    # ---------- read ----------
+
+    def resolve(self, digest_prefix: str) -> str:
+        """Cho phép dùng prefix của digest (như git short hash)."""
+        with closing(self._connect()) as con:
+            rows = con.execute(
+                "SELECT digest FROM blobs WHERE digest LIKE ? LIMIT 2",
+                (digest_prefix.lower() + "%",),
+            ).fetchall()
+        if not rows:
+            raise KeyError(f"Không thấy artifact: {digest_prefix}")
+        if len(rows) > 1:
+            raise KeyError(f"Prefix không duy nhất: {digest_prefix}")
+        return rows[0][0]
+
+    def get_bytes(self, digest: str) -> bytes:
+        digest = self.resolve(digest)
+        raw = self._blob_path(digest).read_bytes()
+        return zstandard.ZstdDecompressor().decompress(raw)
+
+    def get_text(self, digest: str) -> str:
+        return self.get_bytes(digest).decode("utf-8")
+
+    def find(
+        self,
+        run_id: Optional[str] = None,
+        url: Optional[str] = None,
+        name: Optional[str] = None,
+        limit: int = 50,
+    ) -> List[ArtifactRef]:
+        clauses, params = [], []
+        for col, val in (("r.run_id", run_id), ("r.url", url), ("r.name", name)):
+            if val is not None:
+                clauses.append(f"{col} = ?")
+                params.append(val)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        sql = (
+            "SELECT r.run_id, r.name, r.url, r.digest, r.created_at, b.size, b.stored_size "
+            f"FROM refs r JOIN blobs b ON b.digest = r.digest {where} "
+            "ORDER BY r.created_at DESC LIMIT ?"
+        )
+        with closing(self._connect()) as con:
+            rows = con.execute(sql, (*params, limit)).fetchall()
+        return [self._row_to_ref(r) for r in rows]
+
+    # ---------- retention ----------
+
+    def prune(
+        self,
+        max_bytes: Optional[int] = None,
+        max_age_days: Optional[float] = None,
+        max_runs: Optional[int] = None,
+    ) -> dict:
+        """
+        Xoá các run cũ theo giới hạn (tuổi, số run, tổng dung lượng nén),
+        sau đó xoá các blob không còn ref nào.
+        Tham số None => dùng giới hạn cấu hình lúc khởi tạo store.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age_days = self.max_age_days if max_age_days is None else max_age_days
+        max_runs = self.max_runs if max_runs is None else max_runs
+
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            runs = con.execute(
+                "SELECT run_id, MAX(created_at) AS t FROM refs GROUP BY run_id ORDER BY t DESC"
+            ).fetchall()
+
+            drop = set()
+            if max_age_days is not None:
+                cutoff = time.time() - max_age_days * 86400
+                drop.update(r for r, t in runs if t < cutoff)
+            if max_runs is not None:
+                drop.update(r for r, _ in runs[max_runs:])
+            if max_bytes is not None:
+                # giữ run mới nhất trước, cộng dồn dung lượng blob (đếm mỗi blob 1 lần)
+                seen, total = set(), 0
+                for run_id, _ in runs:
+                    if run_id in drop:
+                        continue
+                    rows = con.execute(
+                        "SELECT b.digest, b.stored_size FROM refs r JOIN blobs b ON b.digest = r.digest "
+                        "WHERE r.run_id = ?",
+                        (run_id,),
+                    ).fetchall()
+                    extra = sum(s for d, s in rows if d not in seen)
+                    if total + extra > max_bytes:
+                        drop.add(run_id)
+                        continue
+                    total += extra
+                    seen.update(d for d, _ in rows)
+
+            con.executemany("DELETE FROM refs WHERE run_id = ?", [(r,) for r in drop])
+            orphans = [
+                d
+                for (d,) in con.execute(
+                    "SELECT digest FROM blobs WHERE digest NOT IN (SELECT digest FROM refs)"
+                ).fetchall()
+            ]
+            con.executemany("DELETE FROM blobs WHERE digest = ?", [(d,) for d in orphans])
+            for d in orphans:
+                self._blob_path(d).unlink(missing_ok=True)
+            con.execute("COMMIT")
+        except BaseException:
+            # BEGIN IMMEDIATE hết timeout => chưa có transaction, giữ nguyên lỗi "database is locked"
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+        return {"dropped_runs": len(drop), "deleted_blobs": len(orphans)}
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as con:
+            blobs, size, stored = con.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM blobs"
+            ).fetchone()
+            refs, runs = con.execute("SELECT COUNT(*), COUNT(DISTINCT run_id) FROM refs").fetchone()
+        return {"blobs": blobs, "refs": refs, "runs": runs, "raw_bytes": size, "stored_bytes": stored}
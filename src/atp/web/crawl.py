@@ -0,0 +1,780 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import logging
+import posixpath
+import re
+import sqlite3
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from urllib.parse import parse_qsl, quote, urlencode, urljoin, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+
+from lxml import etree
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import async_playwright
+
+from atp.rag.rag_core import DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE
+from atp.web.extract import extract_text_from_html
+from atp.web.index import index_web_pages
+from atp.web.scrape import _domain, _is_allowed
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FRONTIER_DB = Path("data/crawl.sqlite3")
+DEFAULT_USER_AGENT = "atp-crawler/0.1"
+
+QUEUED = "queued"
+FETCHING = "fetching"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+REDIRECT = "redirect"
+
+# query param chỉ để tracking => bỏ khi normalize để không crawl trùng trang
+_TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid|mc_cid|mc_eid|ref_src)$", re.I)
+_SKIP_SUFFIXES = re.compile(
+    r"\.(?:pdf|zip|gz|tgz|rar|7z|png|jpe?g|gif|svg|webp|ico|bmp|mp3|mp4|webm|avi|mov|"
+    r"css|js|json|xml|woff2?|ttf|eot|exe|dmg|iso|apk)$",
+    re.I,
+)
+_PCT = re.compile(r"%[0-9a-fA-F]{2}")
+_META_CHARSET = re.compile(rb"""charset\s*=\s*["']?([A-Za-z0-9_\-:.]+)""", re.I)
+_HEADER_CHARSET = re.compile(r"""charset\s*=\s*["']?([A-Za-z0-9_\-:.]+)""", re.I)
+
+# HTTP status => host đang bị quá tải / rate limit: lùi lại, thử URL sau
+_BACKOFF_STATUSES = (429, 503)
+MAX_HOST_DELAY_S = 120.0
+
+
+def _remove_dot_segments(path: str) -> str:
+    if not path:
+        return "/"
+    out = posixpath.normpath(path)
+    if out == ".":
+        out = "/"
+    # normpath bỏ "/" cuối và giữ "//" đầu => trả lại như URL
+    if path.endswith("/") and not out.endswith("/"):
+        out += "/"
+    if out.startswith("//"):
+        out = "/" + out.lstrip("/")
+    return out
+
+
+def normalize_url(url: str, base: Optional[str] = None) -> Optional[str]:
+    """
+    Dạng chuẩn để dedupe frontier: chỉ http/https, host chữ thường, bỏ port mặc định,
+    bỏ fragment + query tracking, sắp xếp query, chuẩn hoá percent-encoding và "./..".
+    Trả về None nếu URL không crawl được.
+    """
+    try:
+        if base:
+            url = urljoin(base, url.strip())
+        p = urlsplit(url.strip())
+        scheme = p.scheme.lower()
+        if scheme not in ("http", "https"):
+            return None
+        host = (p.hostname or "").rstrip(".")
+        if not host:
+            return None
+        if ":" in host:
+            host = f"[{host}]"
+        port = p.port
+    except ValueError:
+        return None
+
+    netloc = host if port is None or (scheme, port) in (("http", 80), ("https", 443)) else f"{host}:{port}"
+    path = quote(_remove_dot_segments(p.path), safe="/%:@!$&'()*+,;=-._~")
+    path = _PCT.sub(lambda m: m.group(0).upper(), path)
+    query = [(k, v) for k, v in parse_qsl(p.query, keep_blank_values=True) if not _TRACKING_PARAMS.match(k)]
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), ""))
+
+
+# ---------- frontier ----------
+
+
+class Frontier:
+    """
+    Frontier bền vững trên SQLite: mỗi URL (đã normalize) chỉ có 1 dòng => dedupe,
+    trạng thái lưu ngay => dừng giữa chừng rồi chạy lại sẽ crawl tiếp phần còn lại.
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_FRONTIER_DB):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(self.db_path, timeout=30)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                host TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                http_status INTEGER,
+                error TEXT,
+                content_hash TEXT,
+                redirect_to TEXT,
+                discovered_at REAL NOT NULL,
+                fetched_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS urls_queue ON urls(status, host, depth);
+            CREATE INDEX IF NOT EXISTS urls_content ON urls(content_hash);
+            """
+        )
+
+    def close(self):
+        self._con.close()
+
+    def add(self, items: Iterable[Tuple[str, int]]) -> int:
+        """items: [(url đã normalize, depth)]; trả về số URL mới."""
+        now = time.time()
+        rows = [(u, _domain(u), d, QUEUED, now) for u, d in items]
+        if not rows:
+            return 0
+        before = self._con.total_changes
+        with self._con:
+            self._con.executemany(
+                "INSERT OR IGNORE INTO urls(url, host, depth, status, discovered_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        return self._con.total_changes - before
+
+    def reset_in_flight(self) -> int:
+        """URL đang fetch/chờ index lúc bị dừng => đưa lại vào hàng đợi."""
+        with self._con:
+            cur = self._con.execute("UPDATE urls SET status = ? WHERE status = ?", (QUEUED, FETCHING))
+        return cur.rowcount
+
+    def queued_hosts(self) -> Set[str]:
+        rows = self._con.execute("SELECT DISTINCT host FROM urls WHERE status = ?", (QUEUED,))
+        return {r[0] for r in rows}
+
+    def claim(self, host: str) -> Optional[Tuple[str, int]]:
+        """URL nông nhất còn chờ của host (BFS theo từng host) => đánh dấu fetching."""
+        row = self._con.execute(
+            "SELECT url, depth FROM urls WHERE status = ? AND host = ? ORDER BY depth, rowid LIMIT 1",
+            (QUEUED, host),
+        ).fetchone()
+        if row is None:
+            return None
+        with self._con:
+            self._con.execute("UPDATE urls SET status = ? WHERE url = ?", (FETCHING, row[0]))
+        return row[0], row[1]
+
+    def finish(
+        self,
+        url: str,
+        status: str,
+        http_status: Optional[int] = None,
+        error: Optional[str] = None,
+        content_hash: Optional[str] = None,
+    ):
+        with self._con:
+            self._con.execute(
+                "UPDATE urls SET status = ?, http_status = ?, error = ?, content_hash = ?, fetched_at = ? "
+                "WHERE url = ?",
+                (status, http_status, error, content_hash, time.time(), url),
+            )
+
+    def requeue(self, url: str, error: str, max_attempts: int) -> bool:
+        """Lỗi tạm thời: đưa lại hàng đợi; quá max_attempts => failed. Trả về True nếu còn thử lại."""
+        with self._con:
+            self._con.execute(
+                "UPDATE urls SET attempts = attempts + 1, error = ?, "
+                "status = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END WHERE url = ?",
+                (error, max_attempts, FAILED, QUEUED, url),
+            )
+        row = self._con.execute("SELECT status FROM urls WHERE url = ?", (url,)).fetchone()
+        return row is not None and row[0] == QUEUED
+
+    def redirect(self, url: str, final: str, depth: int, claim: bool = True) -> bool:
+        """
+        url redirect sang final (final được thêm vào hàng đợi nếu chưa có).
+        claim=True: True nếu caller xử lý tiếp final luôn (chưa ai lấy);
+        False nếu final đã/đang được crawl => url chỉ là bản trùng.
+        claim=False: final chờ tới lượt như URL thường; trả về True nếu final vừa được thêm mới.
+        """
+        now = time.time()
+        with self._con:
+            self._con.execute(
+                "UPDATE urls SET status = ?, redirect_to = ?, fetched_at = ? WHERE url = ?",
+                (REDIRECT, final, now, url),
+            )
+            cur = self._con.execute(
+                "INSERT OR IGNORE INTO urls(url, host, depth, status, discovered_at) VALUES (?, ?, ?, ?, ?)",
+                (final, _domain(final), depth, QUEUED, now),
+            )
+            if not claim:
+                return cur.rowcount == 1
+            cur = self._con.execute(
+                "UPDATE urls SET status = ? WHERE url = ? AND status = ?", (FETCHING, final, QUEUED)
+            )
+        return cur.rowcount == 1
+
+    def has_content(self, content_hash: str) -> bool:
+        row = self._con.execute(
+            "SELECT 1 FROM urls WHERE content_hash = ? AND status = ? LIMIT 1", (content_hash, DONE)
+        ).fetchone()
+        return row is not None
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._con.execute("SELECT status, COUNT(*) FROM urls GROUP BY status")
+        return {s: n for s, n in rows}
+
+
+# ---------- crawler ----------
+
+
+@dataclass
+class CrawlConfig:
+    allowed_domains: Sequence[str] = ()
+    max_pages: int = 200
+    max_depth: int = 3
+    concurrency: int = 8
+    per_host: int = 2
+    delay_s: float = 1.0
+    render: bool = False
+    user_agent: str = DEFAULT_USER_AGENT
+    timeout_ms: int = 30000
+    max_bytes: int = 10 * 1024 * 1024
+    max_attempts: int = 3
+    content_selector: Optional[str] = None
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP
+    index_batch_pages: int = 16
+
+
+@dataclass
+class CrawlStats:
+    fetched: int = 0
+    indexed_pages: int = 0
+    indexed_chunks: int = 0
+    skipped: int = 0
+    failed: int = 0
+    retried: int = 0
+    elapsed_s: float = 0.0
+    frontier: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def pages_per_min(self) -> float:
+        return 60.0 * self.fetched / self.elapsed_s if self.elapsed_s else 0.0
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d["pages_per_min"] = round(self.pages_per_min, 1)
+        return d
+
+
+@dataclass
+class _Host:
+    name: str
+    delay_s: float
+    base_delay_s: float
+    active: int = 0
+    next_at: float = 0.0
+    robots: Optional[RobotFileParser] = None
+    robots_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+@dataclass
+class _Page:
+    url: str
+    status: int
+    text: str
+    content_hash: str
+
+
+def _decode(body: bytes, content_type: str) -> str:
+    m = _HEADER_CHARSET.search(content_type or "")
+    enc = m.group(1) if m else None
+    if enc is None:
+        m = _META_CHARSET.search(body[:4096])
+        enc = m.group(1).decode("ascii") if m else "utf-8"
+    try:
+        return body.decode(enc, errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+def _content_length(headers: Dict[str, str]) -> Optional[int]:
+    """Content-Length hợp lệ hoặc None; header lặp ("10, 10") => lấy giá trị đầu, header lỗi => bỏ qua."""
+    value = re.split(r"[,\n]", headers.get("content-length") or "")[0].strip()
+    return int(value) if value.isascii() and value.isdigit() else None
+
+
+def _retry_after(headers: Dict[str, str]) -> Optional[float]:
+    try:
+        return float(headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+
+def _parse_page(html: str, url: str, content_selector: Optional[str]) -> Tuple[str, List[str]]:
+    """
+    (text, links tuyệt đối); tôn trọng meta robots noindex/nofollow và rel=nofollow.
+    Link + meta lấy trong cùng lượt parse stream với text => không dựng cây đầy đủ của trang.
+    """
+    index_ok = follow_ok = True
+    base = url
+    has_base = False
+    hrefs: List[str] = []
+
+    def on_start(elem):
+        nonlocal index_ok, follow_ok, base, has_base
+        tag = elem.tag
+        if tag == "a":
+            href = elem.get("href")
+            if href is not None and "nofollow" not in (elem.get("rel") or "").lower():
+                hrefs.append(href)
+        elif tag == "meta":
+            if (elem.get("name") or "").lower() != "robots":
+                return
+            directives = {t.strip() for t in (elem.get("content") or "").lower().split(",")}
+            if directives & {"noindex", "none"}:
+                index_ok = False
+            if directives & {"nofollow", "none"}:
+                follow_ok = False
+        elif tag == "base" and not has_base and elem.get("href") is not None:
+            has_base = True
+            try:
+                base = urljoin(url, elem.get("href"))
+            except ValueError:
+                pass
+
+    try:
+        text = extract_text_from_html(html, content_selector=content_selector, on_start=on_start)
+    except (etree.ParserError, ValueError):
+        return "", []
+
+    links = []
+    if follow_ok:
+        # normalize_url(href, base) bỏ qua href dị dạng thay vì ném ValueError như urljoin
+        links = [u for u in (normalize_url(h, base) for h in hrefs) if u]
+    return (text if index_ok else ""), links
+
+
+class SiteCrawler:
+    """
+    Crawl lịch sự:
+      - mỗi host tối đa per_host request đồng thời, request sau cách request trước >= delay
+        (max với Crawl-delay/Request-rate của robots.txt), lùi lại khi gặp 429/503
+      - tổng concurrency request trải trên nhiều host cùng lúc
+      - trang lấy được đi qua 1 indexer duy nhất (ghi Chroma theo batch)
+    """
+
+    def __init__(
+        self,
+        frontier: Frontier,
+        chroma_dir: Path,
+        embed_model: str,
+        config: CrawlConfig,
+        progress: Optional[Callable[[CrawlStats], None]] = None,
+    ):
+        self.frontier = frontier
+        self.chroma_dir = Path(chroma_dir)
+        self.embed_model = embed_model
+        self.cfg = config
+        self.progress = progress
+        self.stats = CrawlStats()
+        self._hosts: Dict[str, _Host] = {}
+        self._pending_hosts: Set[str] = set()
+        self._index_q: asyncio.Queue = asyncio.Queue(maxsize=config.index_batch_pages * 2)
+        self._started = 0.0
+        self._request = None
+        self._browser_ctx = None
+
+    # ---------- frontier ----------
+
+    def _accept(self, url: Optional[str]) -> bool:
+        if url is None or _SKIP_SUFFIXES.search(urlsplit(url).path):
+            return False
+        return _is_allowed(url, self.cfg.allowed_domains)
+
+    def enqueue(self, urls: Iterable[str], depth: int) -> int:
+        items = []
+        for u in urls:
+            n = normalize_url(u)
+            if self._accept(n):
+                items.append((n, depth))
+                self._pending_hosts.add(_domain(n))
+        return self.frontier.add(items)
+
+    async def load_sitemap(self, url: str, limit: int = 50000) -> int:
+        """Seed từ sitemap.xml (hỗ trợ sitemap index và .gz)."""
+        todo, seen, found = [url], set(), []
+        while todo and len(found) < limit:
+            sm = todo.pop()
+            if sm in seen:
+                continue
+            seen.add(sm)
+            try:
+                resp = await self._request.get(sm, timeout=self.cfg.timeout_ms)
+                status = resp.status
+                body = await resp.body() if status < 400 else b""
+                await resp.dispose()
+            except PlaywrightError as e:
+                log.warning("sitemap %s: %s", sm, e)
+                continue
+            if status >= 400:
+                log.warning("sitemap %s: HTTP %s", sm, status)
+                continue
+            try:
+                if body[:2] == b"\x1f\x8b":
+                    body = gzip.decompress(body)
+                parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True)
+                root = etree.fromstring(body, parser=parser)
+            except (OSError, etree.XMLSyntaxError) as e:
+                log.warning("sitemap %s: %s", sm, e)
+                continue
+            if root is None:
+                continue
+            locs = [(e.text or "").strip() for e in root.iter("{*}loc")]
+            if etree.QName(root).localname == "sitemapindex":
+                todo.extend(locs)
+            else:
+                found.extend(locs)
+        return self.enqueue(found[:limit], 0)
+
+    # ---------- robots ----------
+
+    async def _robots(self, host: _Host, scheme: str) -> RobotFileParser:
+        async with host.robots_lock:
+            if host.robots is not None:
+                return host.robots
+            rp = RobotFileParser()
+            robots_url = f"{scheme}://{host.name}/robots.txt"
+            try:
+                resp = await self._request.get(robots_url, timeout=self.cfg.timeout_ms)
+                status = resp.status
+                text = await resp.text() if status < 400 else ""
+                await resp.dispose()
+            except PlaywrightError as e:
+                log.warning("robots %s: %s", robots_url, e)
+                status, text = 599, ""
+            # giống RobotFileParser.read(): 401/403 => cấm hết, 4xx khác => cho phép hết;
+            # 5xx / lỗi mạng => coi như cấm (không chắc server đang cho phép)
+            if status in (401, 403) or status >= 500:
+                rp.disallow_all = True
+            elif status >= 400:
+                rp.allow_all = True
+            else:
+                rp.parse(text.splitlines())
+            delay = rp.crawl_delay(self.cfg.user_agent)
+            rate = rp.request_rate(self.cfg.user_agent)
+            if delay:
+                host.base_delay_s = max(host.base_delay_s, float(delay))
+            if rate and rate.requests:
+                host.base_delay_s = max(host.base_delay_s, rate.seconds / rate.requests)
+            host.delay_s = max(host.delay_s, host.base_delay_s)
+            host.robots = rp
+            return rp
+
+    # ---------- fetch ----------
+
+    async def _get(self, url: str) -> Tuple[str, int, Dict[str, str], Optional[str]]:
+        """
+        (final url, status, headers, html hoặc None nếu không phải HTML).
+        Không theo redirect: 3xx trả về final = Location, html None => caller xếp hàng final.
+        Render mode: trình duyệt tự theo redirect, final = URL cuối cùng.
+        """
+        if not self.cfg.render:
+            resp = await self._request.get(url, timeout=self.cfg.timeout_ms, max_redirects=0)
+            try:
+                headers = resp.headers
+                if 300 <= resp.status < 400:
+                    location = headers.get("location")
+                    return (urljoin(url, location) if location else url), resp.status, headers, None
+                ctype = headers.get("content-type", "")
+                if resp.status >= 400 or "html" not in ctype.lower():
+                    return resp.url, resp.status, headers, None
+                if (_content_length(headers) or 0) > self.cfg.max_bytes:
+                    return resp.url, resp.status, headers, None
+                body = await resp.body()
+                if len(body) > self.cfg.max_bytes:
+                    return resp.url, resp.status, headers, None
+                return resp.url, resp.status, headers, _decode(body, ctype)
+            finally:
+                await resp.dispose()
+
+        page = await self._browser_ctx.new_page()
+        try:
+            resp = await page.goto(url, wait_until="domcontentloaded", timeout=self.cfg.timeout_ms)
+            status = resp.status if resp is not None else 0
+            headers = await resp.all_headers() if resp is not None else {}
+            if status >= 400 or "html" not in headers.get("content-type", "html").lower():
+                return page.url, status, headers, None
+            return page.url, status, headers, await page.content()
+        finally:
+            await page.close()
+
+    async def _fetch(self, host: _Host, url: str, depth: int):
+        cfg = self.cfg
+        ok = False
+        try:
+            rp = await self._robots(host, urlsplit(url).scheme)
+            if not rp.can_fetch(cfg.user_agent, url):
+                self.frontier.finish(url, SKIPPED, error="robots.txt")
+                self.stats.skipped += 1
+                return
+
+            final, status, headers, html = await self._get(url)
+            self.stats.fetched += 1
+
+            if status in _BACKOFF_STATUSES:
+                wait = _retry_after(headers) or host.delay_s * 2
+                host.delay_s = min(MAX_HOST_DELAY_S, max(host.delay_s * 2, wait))
+                host.next_at = max(host.next_at, time.monotonic() + min(wait, MAX_HOST_DELAY_S))
+                log.info("host %s trả %s => delay %.1fs", host.name, status, host.delay_s)
+                self._retry(url, f"HTTP {status}")
+                return
+            if status >= 400:
+                self.frontier.finish(url, FAILED, http_status=status)
+                self.stats.failed += 1
+                return
+            ok = True
+
+            final = normalize_url(final) or url
+            if final != url:
+                if not self._accept(final):
+                    self.frontier.finish(url, SKIPPED, http_status=status, error=f"redirect -> {final}")
+                    self.stats.skipped += 1
+                    return
+                # chỉ dùng luôn nội dung (render mode) khi final cùng host và robots.txt cho phép;
+                # còn lại final xếp hàng như URL thường => qua robots.txt + giới hạn request của host đó
+                inline = html is not None and _domain(final) == host.name and rp.can_fetch(cfg.user_agent, final)
+                if not inline:
+                    self.frontier.redirect(url, final, depth, claim=False)
+                    self._pending_hosts.add(_domain(final))
+                    return
+                if not self.frontier.redirect(url, final, depth):
+                    # final đã/đang được crawl từ link khác
+                    self.stats.skipped += 1
+                    return
+                url = final
+            elif 300 <= status < 400:
+                self.frontier.finish(url, FAILED, http_status=status, error="redirect without Location")
+                self.stats.failed += 1
+                return
+            if html is None:
+                self.frontier.finish(url, SKIPPED, http_status=status, error="not html")
+                self.stats.skipped += 1
+                return
+
+            text, links = await asyncio.to_thread(_parse_page, html, url, cfg.content_selector)
+            if depth < cfg.max_depth and links:
+                self.enqueue(links, depth + 1)
+
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            if not text or self.frontier.has_content(digest):
+                # trang rỗng / noindex / trùng nội dung trang khác => không index lại
+                self.frontier.finish(url, DONE, http_status=status)
+                self.stats.skipped += 1
+                return
+            # queue có giới hạn => fetch tự chậm lại khi indexer không theo kịp
+            await self._index_q.put(_Page(url=url, status=status, text=text, content_hash=digest))
+        except PlaywrightError as e:
+            self._retry(url, str(e).splitlines()[0] if str(e) else type(e).__name__)
+        except Exception as e:
+            # lỗi riêng của URL này (header/HTML dị dạng, ...) không được làm dừng cả crawl;
+            # thử lại tối đa max_attempts rồi failed => resume không vấp lại mãi 1 URL
+            log.warning("fetch %s: %r", url, e)
+            self._retry(url, f"{type(e).__name__}: {e}")
+        finally:
+            host.active -= 1
+            if ok:
+                # thành công => giảm dần delay về mức cơ bản sau khi từng bị lùi
+                host.delay_s = max(host.base_delay_s, host.delay_s * 0.9)
+            self._report()
+
+    def _retry(self, url: str, error: str):
+        if self.frontier.requeue(url, error, self.cfg.max_attempts):
+            self.stats.retried += 1
+            self._pending_hosts.add(_domain(url))
+        else:
+            self.stats.failed += 1
+
+    # ---------- index ----------
+
+    async def _indexer(self):
+        cfg = self.cfg
+        while True:
+            page = await self._index_q.get()
+            if page is None:
+                return
+            batch = [page]
+            stop = False
+            while len(batch) < cfg.index_batch_pages and not self._index_q.empty():
+                nxt = self._index_q.get_nowait()
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            # trùng nội dung trong cùng batch
+            unique: Dict[str, _Page] = {}
+            for p in batch:
+                unique.setdefault(p.content_hash, p)
+            n = await asyncio.to_thread(
+                index_web_pages,
+                [(p.url, p.text) for p in unique.values()],
+                self.chroma_dir,
+                embed_model=self.embed_model,
+                chunk_size=cfg.chunk_size,
+                chunk_overlap=cfg.chunk_overlap,
+            )
+            for p in batch:
+                indexed = unique[p.content_hash] is p
+                self.frontier.finish(
+                    p.url, DONE, http_status=p.status, content_hash=p.content_hash if indexed else None
+                )
+            self.stats.indexed_pages += len(unique)
+            self.stats.indexed_chunks += n
+            self._report()
+            if stop:
+                return
+
+    def _report(self):
+        self.stats.elapsed_s = time.monotonic() - self._started
+        if self.progress is not None:
+            self.progress(self.stats)
+
+    # ---------- scheduler ----------
+
+    def _host(self, name: str) -> _Host:
+        h = self._hosts.get(name)
+        if h is None:
+            h = _Host(name=name, delay_s=self.cfg.delay_s, base_delay_s=self.cfg.delay_s)
+            self._hosts[name] = h
+        return h
+
+    def _dispatch(self, tasks: Set[asyncio.Task], budget: int) -> int:
+        """Gán URL cho các host đang rảnh (round-robin), trả về số task mới."""
+        now = time.monotonic()
+        started = 0
+        for name in sorted(self._pending_hosts, key=lambda n: self._host(n).next_at):
+            if len(tasks) >= self.cfg.concurrency or started >= budget:
+                break
+            host = self._host(name)
+            while host.active < self.cfg.per_host and host.next_at <= now and started < budget:
+                claimed = self.frontier.claim(name)
+                if claimed is None:
+                    self._pending_hosts.discard(name)
+                    break
+                url, depth = claimed
+                if host.robots is not None and not host.robots.can_fetch(self.cfg.user_agent, url):
+                    self.frontier.finish(url, SKIPPED, error="robots.txt")
+                    self.stats.skipped += 1
+                    continue
+                host.active += 1
+                host.next_at = now + host.delay_s
+                tasks.add(asyncio.create_task(self._fetch(host, url, depth)))
+                started += 1
+                if len(tasks) >= self.cfg.concurrency:
+                    break
+        return started
+
+    async def run(self, seeds: Sequence[str] = (), sitemaps: Sequence[str] = ()) -> CrawlStats:
+        cfg = self.cfg
+        self._started = time.monotonic()
+        requeued = self.frontier.reset_in_flight()
+        if requeued:
+            log.info("resume: %d URL đang dở được đưa lại hàng đợi", requeued)
+
+        async with async_playwright() as p:
+            self._request = await p.request.new_context(user_agent=cfg.user_agent)
+            browser = None
+            if cfg.render:
+                browser = await p.chromium.launch(headless=True)
+                self._browser_ctx = await browser.new_context(user_agent=cfg.user_agent)
+            try:
+                self.enqueue(seeds, 0)
+                for sm in sitemaps:
+                    await self.load_sitemap(sm)
+                self._pending_hosts |= self.frontier.queued_hosts()
+
+                indexer = asyncio.create_task(self._indexer())
+                tasks: Set[asyncio.Task] = set()
+                dispatched = 0
+                try:
+                    while True:
+                        if indexer.done():
+                            indexer.result()  # lỗi index (vd: Ollama chết) => dừng crawl, lần sau resume
+                            raise RuntimeError("Indexer dừng bất thường")
+                        if dispatched < cfg.max_pages:
+                            dispatched += self._dispatch(tasks, cfg.max_pages - dispatched)
+                        if not tasks and (dispatched >= cfg.max_pages or not self._pending_hosts):
+                            break
+                        # ngủ tới khi 1 fetch xong hoặc host sớm nhất hết delay
+                        timeout = None
+                        if len(tasks) < cfg.concurrency and dispatched < cfg.max_pages:
+                            now = time.monotonic()
+                            wake = [
+                                self._host(n).next_at - now
+                                for n in self._pending_hosts
+                                if self._host(n).active < cfg.per_host
+                            ]
+                            timeout = max(0.05, min(wake)) if wake else 1.0
+                        # chờ cả indexer: nó chết thì fetch đang kẹt ở _index_q.put() không bao giờ xong
+                        done, _ = await asyncio.wait(
+                            {*tasks, indexer}, timeout=timeout or 1.0, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        tasks -= done
+                        for t in done:
+                            if t is not indexer:
+                                t.result()
+                except BaseException:
+                    indexer.cancel()
+                    await asyncio.gather(indexer, return_exceptions=True)
+                    raise
+                finally:
+                    for t in tasks:
+                        t.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+
+                # queue có thể đang đầy => put(None) cũng phải chờ cùng indexer
+                stop = asyncio.create_task(self._index_q.put(None))
+                await asyncio.wait({stop, indexer}, return_when=asyncio.FIRST_COMPLETED)
+                stop.cancel()
+                await indexer
+            finally:
+                await self._request.dispose()
+                if browser is not None:
+                    await browser.close()
+
+        self.stats.frontier = self.frontier.counts()
+        self._report()
+        return self.stats
+
+
+async def crawl_site(
+    seeds: Sequence[str],
+    chroma_dir: Path,
+    embed_model: str = "embeddinggemma",
+    sitemaps: Sequence[str] = (),
+    frontier_db: Path = DEFAULT_FRONTIER_DB,
+    config: Optional[CrawlConfig] = None,
+    progress: Optional[Callable[[CrawlStats], None]] = None,
+) -> CrawlStats:
+    """
+    Crawl từ seeds/sitemaps rồi index thẳng vào chroma_dir.
+    allowed_domains mặc định = các host của seeds + sitemaps (theo _is_allowed).
+    """
+    config = config or CrawlConfig()
+    if not config.allowed_domains:
+        hosts = {urlsplit(normalize_url(u) or "").netloc for u in [*seeds, *sitemaps]}
+        config.allowed_domains = sorted(h for h in hosts if h)
+    if not config.allowed_domains:
+        raise ValueError("Cần ít nhất 1 seed URL / sitemap hợp lệ")
+
+    frontier = Frontier(frontier_db)
+    try:
+        crawler = SiteCrawler(frontier, chroma_dir, embed_model, config, progress=progress)
+        return await crawler.run(seeds=seeds, sitemaps=sitemaps)
+    finally:
+        frontier.close()
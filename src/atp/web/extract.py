@@ -0,0 +1,417 @@
+from __future__ import annotations
+
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from lxml import etree
+from lxml.html import fromstring
+
+IGNORED_TAGS = frozenset(("script", "style", "noscript"))
+FEED_CHARS = 1 << 16
+
+# cùng điều kiện với lxml.html.fromstring: chỉ tài liệu đầy đủ mới parse giống hệt nhau
+_FULL_HTML = re.compile(r"^\s*<(?:html|!doctype)", re.I)
+# các ký tự str.splitlines() coi là xuống dòng
+_LINE_BREAK = re.compile("[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+_XPATH_SPACE = re.compile("[ \t\r\n]+")
+_NON_WHITESPACE = re.compile(r"^[^ \t\r\n\f]+$")
+
+Matcher = Callable[[List[etree._Element], int], bool]
+# gọi với mỗi thẻ mở (đã có đủ attribute) trong cùng lượt parse, vd: gom link / meta robots
+StartHook = Callable[[etree._Element], None]
+
+
+def _extract_text_legacy(
+    html: str,
+    content_selector: Optional[str] = None,
+    on_start: Optional[StartHook] = None,
+) -> str:
+    doc = fromstring(html)
+    if on_start is not None:
+        for el in doc.iter(tag=etree.Element):
+            on_start(el)
+
+    # bỏ các phần không cần thiết
+    for bad in doc.xpath("//script|//style|//noscript"):
+        parent = bad.getparent()
+        if parent is not None:
+            parent.remove(bad)
+
+    if content_selector:
+        # Lấy đúng vùng nội dung theo CSS selector (ví dụ: "article")
+        nodes = doc.cssselect(content_selector)
+        if nodes:
+            text = "\n".join(n.text_content() for n in nodes)
+        else:
+            # fallback: lấy toàn trang nếu selector không match
+            text = doc.text_content()
+    else:
+        text = doc.text_content()
+
+    # normalize whitespace
+    text = "\n".join(line.strip() for line in text.splitlines() if line.strip())
+    return text
+
+
+# ---------- CSS selector -> matcher trên stack tổ tiên ----------
+
+
+class _Unsupported(Exception):
+    """Selector ngoài tập con hỗ trợ khi stream => dùng đường cũ (cssselect + XPath)."""
+
+
+def _attr_test(op: str, value: Optional[str]) -> Callable[[Optional[str]], bool]:
+    # cùng ngữ nghĩa với cssselect.HTMLTranslator (xem xpath_attrib_*)
+    if op == "exists":
+        return lambda a: a is not None
+    if op == "=":
+        return lambda a: a == value
+    if op == "!=":
+        if value:
+            return lambda a: a is None or a != value
+        return lambda a: a is not None and a != value
+    if op == "~=":
+        if not value or not _NON_WHITESPACE.match(value):
+            return lambda a: False
+        return lambda a: a is not None and value in _XPATH_SPACE.split(a)
+    if op == "|=":
+        return lambda a: a is not None and (a == value or a.startswith(value + "-"))
+    if op == "^=":
+        return lambda a: bool(value) and a is not None and a.startswith(value)
+    if op == "$=":
+        return lambda a: bool(value) and a is not None and a.endswith(value)
+    if op == "*=":
+        return lambda a: bool(value) and a is not None and value in a
+    raise _Unsupported(op)
+
+
+def _compile(node) -> Matcher:
+    from cssselect import parser as css
+
+    if isinstance(node, css.Element):
+        if node.namespace is not None:
+            raise _Unsupported("namespace")
+        tag = (node.element or "*").lower()
+        if tag == "*":
+            return lambda stack, i: True
+        return lambda stack, i: stack[i].tag == tag
+
+    if isinstance(node, (css.Hash, css.Class, css.Attrib)):
+        inner = _compile(node.selector)
+        if isinstance(node, css.Hash):
+            name, test = "id", _attr_test("=", node.id)
+        elif isinstance(node, css.Class):
+            name, test = "class", _attr_test("~=", node.class_name)
+        else:
+            if node.namespace is not None or getattr(node, "flag", None):
+                raise _Unsupported("attrib namespace/flag")
+            value = node.value.value if node.value is not None else None
+            name, test = node.attrib.lower(), _attr_test(node.operator, value)
+        return lambda stack, i: test(stack[i].get(name)) and inner(stack, i)
+
+    if isinstance(node, css.CombinedSelector):
+        left, right = _compile(node.selector), _compile(node.subselector)
+        if node.combinator == ">":
+            return lambda stack, i: right(stack, i) and i > 0 and left(stack, i - 1)
+        if node.combinator == " ":
+            return lambda stack, i: right(stack, i) and any(left(stack, j) for j in range(i - 1, -1, -1))
+        raise _Unsupported(node.combinator)
+
+    raise _Unsupported(type(node).__name__)
+
+
+def compile_selector(content_selector: str) -> Matcher:
+    """
+    Tập con CSS match được ngay lúc gặp thẻ mở: tag, *, #id, .class, [attr...], " " và ">".
+    Pseudo-class, ~/+ ... => _Unsupported.
+    """
+    from cssselect import parse
+
+    matchers = []
+    for sel in parse(content_selector):
+        if sel.pseudo_element is not None:
+            raise _Unsupported("pseudo-element")
+        matchers.append(_compile(sel.parsed_tree))
+    return lambda stack, i: any(m(stack, i) for m in matchers)
+
+
+# ---------- stream ----------
+
+
+class _LineSink:
+    """Nhận text từng mảnh, trả về các dòng đã strip (bỏ dòng rỗng) giống splitlines()."""
+
+    def __init__(self):
+        self._pieces: List[str] = []
+        self._carry: List[str] = []  # dòng chưa kết thúc
+        self.lines: deque = deque()
+        self.write = self._pieces.append
+
+    def flush(self, final: bool = False):
+        new = "".join(self._pieces)
+        self._pieces.clear()
+        if not final and not _LINE_BREAK.search(new):
+            if new:
+                self._carry.append(new)
+            return
+        self._carry.append(new)
+        parts = "".join(self._carry).splitlines(True)
+        self._carry.clear()
+        if not final and parts:
+            last = parts[-1]
+            # "\r" cuối có thể là nửa đầu của "\r\n" => giữ lại chờ mảnh sau
+            if not _LINE_BREAK.match(last[-1]) or last.endswith("\r"):
+                self._carry.append(parts.pop())
+        for line in parts:
+            line = line.strip()
+            if line:
+                self.lines.append(line)
+
+    def reset(self):
+        self._pieces.clear()
+        self._carry.clear()
+        self.lines.clear()
+
+
+class _Capture:
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.sink = _LineSink()
+        self.done = False
+
+
+class _Frame:
+    __slots__ = ("elem", "skip", "prev", "prev_dropped")
+
+    def __init__(self, elem, skip: bool):
+        self.elem = elem
+        self.skip = skip
+        self.prev = None  # con đã xử lý gần nhất (tail chưa lấy)
+        self.prev_dropped = False
+
+
+def _chunks(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    if isinstance(source, str):
+        for i in range(0, len(source), FEED_CHARS):
+            yield source[i : i + FEED_CHARS]
+    else:
+        yield from source
+
+
+def _stream_lines(
+    chunks: Iterable[str],
+    match: Optional[Matcher],
+    on_start: Optional[StartHook] = None,
+) -> Iterator[str]:
+    parser = etree.HTMLPullParser(events=("start", "end", "comment", "pi"))
+    stack: List[_Frame] = []
+    elems: List[etree._Element] = []
+    page = _LineSink()
+    captures: deque = deque()  # theo thứ tự thẻ mở (= thứ tự kết quả cssselect)
+    active: List[_Capture] = []
+    matched = False
+    root_done = False
+
+    def emit(s: Optional[str]):
+        if not s:
+            return
+        if not matched:
+            page.write(s)
+        for c in active:
+            c.sink.write(s)
+
+    def before_child(frame: _Frame):
+        # text đứng trước con mới: text của cha (con đầu) hoặc tail của anh liền trước
+        if frame.prev is None:
+            emit(frame.elem.text)
+            return
+        prev = frame.prev
+        if not frame.prev_dropped:
+            # remove() của bản cũ mang theo tail của script/style/noscript
+            emit(prev.tail)
+        # giải phóng anh đã xử lý xong => bộ nhớ không tăng theo độ dài trang
+        frame.elem.remove(prev)
+
+    def handle(event: str, elem):
+        nonlocal matched, root_done
+        if root_done:
+            # libxml2 (push) tạo thêm 1 <html> cho text sau </html>; fromstring không lấy phần này
+            return
+        if event == "start":
+            if on_start is not None:
+                on_start(elem)
+            parent = stack[-1] if stack else None
+            skip = parent is not None and parent.skip
+            if parent is not None and not skip:
+                before_child(parent)
+            dropped = skip or elem.tag in IGNORED_TAGS
+            stack.append(_Frame(elem, dropped))
+            elems.append(elem)
+            if match is not None and not dropped and match(elems, len(elems) - 1):
+                if not matched:
+                    matched = True
+                    page.reset()
+                cap = _Capture(len(stack))
+                captures.append(cap)
+                active.append(cap)
+            return
+
+        if event in ("comment", "pi"):
+            # text_content() bỏ qua nội dung comment/PI nhưng vẫn lấy tail
+            if stack and not stack[-1].skip:
+                frame = stack[-1]
+                before_child(frame)
+                frame.prev, frame.prev_dropped = elem, False
+            return
+
+        frame = stack.pop()
+        elems.pop()
+        if not frame.skip:
+            if frame.prev is None:
+                emit(elem.text)
+            else:
+                if not frame.prev_dropped:
+                    emit(frame.prev.tail)
+                elem.remove(frame.prev)
+        if active and active[-1].depth == len(stack) + 1:
+            cap = active.pop()
+            cap.sink.flush(final=True)
+            cap.done = True
+        if not stack:
+            root_done = True
+        else:
+            parent = stack[-1]
+            if not parent.skip:
+                parent.prev, parent.prev_dropped = elem, frame.skip
+            else:
+                parent.elem.remove(elem)
+
+    def drain() -> Iterator[str]:
+        if not matched:
+            page.flush()
+        for c in active:
+            c.sink.flush()
+        if match is None or not matched:
+            if match is None:
+                while page.lines:
+                    yield page.lines.popleft()
+            return
+        while captures:
+            head = captures[0]
+            while head.sink.lines:
+                yield head.sink.lines.popleft()
+            if not head.done:
+                return
+            captures.popleft()
+
+    for chunk in _chunks(chunks):
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            handle(event, elem)
+        yield from drain()
+    parser.close()
+    for event, elem in parser.read_events():
+        handle(event, elem)
+
+    if not root_done and not stack:
+        # giống lxml.html.document_fromstring
+        raise etree.ParserError("Document is empty")
+    page.flush(final=True)
+    yield from drain()
+    if match is not None and not matched:
+        # fallback: lấy toàn trang nếu selector không match
+        yield from page.lines
+
+
+def iter_text_lines(
+    html: Union[str, Iterable[str]],
+    content_selector: Optional[str] = None,
+    on_start: Optional[StartHook] = None,
+) -> Iterator[str]:
+    """
+    Trích text đã normalize theo từng dòng, parse 1 lượt (pull parser) và bỏ script/style/noscript
+    ngay khi gặp, giải phóng các node đã đọc => bộ nhớ không tỉ lệ với kích thước trang.
+
+    html: cả chuỗi hoặc iterable các mảnh text (ví dụ file mở ở chế độ text).
+    Kết quả giống hệt bản cũ ("\\n".join(...) == _extract_text_legacy(...)); các trường hợp stream
+    không đảm bảo được (fragment, selector ngoài tập con hỗ trợ) sẽ dùng lại bản cũ.
+    on_start: gọi với mọi element theo thứ tự tài liệu (kể cả phần bị bỏ như noscript),
+    để caller lấy thêm thông tin (link, meta) mà không phải parse lại trang.
+    """
+    chunks = _chunks(html)
+    head = next(chunks, "")
+    # cần đủ đoạn đầu để quyết định như fromstring (bỏ khoảng trắng đầu file)
+    while head.isspace() or (len(head) < 16 and not _FULL_HTML.match(head)):
+        more = next(chunks, None)
+        if more is None:
+            break
+        head += more
+
+    match = None
+    streamable = bool(_FULL_HTML.match(head))
+    if streamable and content_selector:
+        try:
+            match = compile_selector(content_selector)
+        except Exception:
+            streamable = False
+
+    if not streamable:
+        text = _extract_text_legacy(head + "".join(chunks), content_selector, on_start)
+        if text:
+            yield from text.split("\n")
+        return
+
+    def _all():
+        yield head
+        yield from chunks
+
+    yield from _stream_lines(_all(), match, on_start)
+
+
+def extract_text_from_html(
+    html: str,
+    content_selector: Optional[str] = None,
+    on_start: Optional[StartHook] = None,
+) -> str:
+    return "\n".join(iter_text_lines(html, content_selector=content_selector, on_start=on_start))
+
+
+# ---------- batch ----------
+
+
+def _extract_file(job: Tuple[str, str, Optional[str]]) -> Tuple[str, str, int]:
+    src, dst, content_selector = job
+    lines = 0
+    Path(dst).parent.mkdir(parents=True, exist_ok=True)
+    with open(src, encoding="utf-8", errors="replace", newline="") as f, open(dst, "w", encoding="utf-8") as out:
+        reader = iter(lambda: f.read(FEED_CHARS), "")
+        for line in iter_text_lines(reader, content_selector=content_selector):
+            if lines:
+                out.write("\n")
+            out.write(line)
+            lines += 1
+    return src, dst, lines
+
+
+def extract_html_files(
+    pairs: Sequence[Tuple[Path, Path]],
+    content_selector: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[str, str, int]]:
+    """
+    Trích text nhiều file HTML song song (mỗi file 1 task trong process pool).
+    pairs: [(file html, file .txt đích)]; yield (src, dst, số dòng) theo thứ tự đầu vào.
+    Worker ghi thẳng ra file đích => không phải gửi text lớn về process cha.
+    """
+    jobs = [(str(s), str(d), content_selector) for s, d in pairs]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield _extract_file(job)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        yield from pool.map(_extract_file, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
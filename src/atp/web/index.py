@@ -1,9 +1,23 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Sequence, Tuple
 
-from atp.rag.rag_core import add_textfile_to_vectorstore
+from atp.rag.rag_core import (
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_CHUNK_SIZE,
+    add_chunks_to_vectorstore,
+    add_text_to_vectorstore,
+    add_textfile_to_vectorstore,
+    split_text,
+)
+
+
+def _web_metadata(url: str, extra_metadata: Optional[dict] = None) -> dict:
+    metadata = {"source_type": "web", "url": url}
+    if extra_metadata:
+        metadata.update(extra_metadata)
+    return metadata
 
 
 def index_web_text(
@@ -11,19 +25,57 @@ def index_web_text(
     chroma_dir: Path,
     url: str,
     embed_model: str = "embeddinggemma",
-    chunk_size: int = 1500,
-    chunk_overlap: int = 200,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
     extra_metadata: Optional[dict] = None,
 ) -> int:
-    metadata = {"source_type": "web", "url": url}
-    if extra_metadata:
-        metadata.update(extra_metadata)
-
     return add_textfile_to_vectorstore(
         text_path=text_path,
         persist_dir=chroma_dir,
         embed_model=embed_model,
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
-        metadata=metadata,
+        metadata=_web_metadata(url, extra_metadata),
+    )
+
+
+def index_web_content(
+    text: str,
+    chroma_dir: Path,
+    url: str,
+    embed_model: str = "embeddinggemma",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    extra_metadata: Optional[dict] = None,
+) -> int:
+    """Index text đã có trong bộ nhớ (vd: lấy từ artifact store), không cần file trung gian."""
+    return add_text_to_vectorstore(
+        text=text,
+        persist_dir=chroma_dir,
+        embed_model=embed_model,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        metadata=_web_metadata(url, extra_metadata),
+    )
+
+
+def index_web_pages(
+    pages: Sequence[Tuple[str, str]],
+    chroma_dir: Path,
+    embed_model: str = "embeddinggemma",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    extra_metadata: Optional[dict] = None,
+) -> int:
+    """Index nhiều trang [(url, text)] trong 1 lần ghi: mở Chroma 1 lần, embed theo batch đầy."""
+    chunks = []
+    for url, text in pages:
+        chunks.extend(split_text(text, chunk_size, chunk_overlap, metadata=_web_metadata(url, extra_metadata)))
+    if not chunks:
+        return 0
+    return add_chunks_to_vectorstore(
+        chunks,
+        chroma_dir,
+        embed_model=embed_model,
+        chunking={"chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
     )
@@ -4,9 +4,10 @@ from dataclasses import dataclass
 from typing import Optional, Sequence
 from urllib.parse import urlparse
 
-from lxml.html import fromstring
 from playwright.async_api import async_playwright
 
+from atp.web.extract import extract_text_from_html
+
 
 @dataclass
 class ScrapeResult:
@@ -25,31 +26,6 @@ def _is_allowed(url: str, allowed_domains: Sequence[str]) -> bool:
     return any(d == a or d.endswith("." + a) for a in allow)
 
 
-def extract_text_from_html(html: str, content_selector: Optional[str] = None) -> str:
-    doc = fromstring(html)
-
-    # bỏ các phần không cần thiết
-    for bad in doc.xpath("//script|//style|//noscript"):
-        parent = bad.getparent()
-        if parent is not None:
-            parent.remove(bad)
-
-    if content_selector:
-        # Lấy đúng vùng nội dung theo CSS selector (ví dụ: "article")
-        nodes = doc.cssselect(content_selector)
-        if nodes:
-            text = "\n".join(n.text_content() for n in nodes)
-        else:
-            # fallback: lấy toàn trang nếu selector không match
-            text = doc.text_content()
-    else:
-        text = doc.text_content()
-
-    # normalize whitespace
-    text = "\n".join(line.strip() for line in text.splitlines() if line.strip())
-    return text
-
-
 async def scrape_url(
     url: str,
     allowed_domains: Optional[Sequence[str]] = None,